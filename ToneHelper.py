@@ -1,3 +1,6 @@
+from errors import ChordError
+
+
 # class for dealing with tones and notes
 class ToneHelper:
     # used to map notes to sound frequencies
@@ -9,10 +12,12 @@ class ToneHelper:
 
     chromatic = ["C", "C#/Db", "D", "D#/Eb", "E", "F", "F#/Gb", "G", "G#/Ab", "A", "A#/Bb", "B"]
 
-    # used for translating fret-based input
-    guitar_map_standard_tuning = dict(E=chromatic[-8:] + chromatic[:-8], A=chromatic[-3:] + chromatic[:-3],
-                                      D=chromatic[-10:] + chromatic[:-10], G=chromatic[-5:] + chromatic[:-5],
-                                      B=["B", "C", "C#/Db", "D", "D#/Eb", "E", "F", "F#/Gb", "G", "G#/Ab", "A", "A#/Bb"])
+    # spellings of each pitch class, used only where a note name has to be written out
+    sharp_names = [name.split("/")[0] for name in chromatic]
+    flat_names = [name.split("/")[-1] for name in chromatic]
+
+    # pitch classes of the open strings in standard tuning, low E to high E
+    standard_tuning = [4, 9, 2, 7, 11, 4]
 
     # used for translating chords to notes
     chord_dict = {
@@ -105,35 +110,132 @@ class ToneHelper:
         "vii": 6, "vi": 5, "iii": 2, "ii": 1, "iv": 3, "v": 4, "i": 0
     }
 
+    major_steps = [0, 2, 4, 5, 7, 9, 11]  # semitones from the tonic to each degree of a major scale
+
+    letter_pitch_classes = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+
+    pitch_classes = {}  # note name -> pitch class, filled in as names are read
+
+    @staticmethod
+    def pitch_class(note: str) -> int:
+        """
+        Returns the pitch class (0 = C ... 11 = B) of a note name.
+        :param note: the note, e.g. 'Db' or 'E#'
+        :return: the pitch class
+        """
+        pc = ToneHelper.pitch_classes.get(note)
+        if pc is None:
+            pc = (ToneHelper.letter_pitch_classes[note[0]] + note.count("#") - note.count("b")) % 12
+            ToneHelper.pitch_classes[note] = pc
+
+        return pc
+
+    @staticmethod
+    def name(pc: int, flats=False) -> str:
+        """
+        Spells a pitch class without regard to key.
+        :param pc: the pitch class (any integer, taken modulo 12)
+        :param flats: spell black keys as flats rather than sharps
+        :return: the note name
+        """
+        return (ToneHelper.flat_names if flats else ToneHelper.sharp_names)[pc % 12]
+
+    @staticmethod
+    def key_root(k: str) -> str:
+        """
+        Returns the tonic of a key signature.
+        :param k: the key signature, e.g. 'Dbmaj'
+        :return: the tonic, e.g. 'Db'
+        """
+        return k[:2] if k[:2] in ToneHelper.scale_dict else k[0]
+
+    @staticmethod
+    def scale_pitch_classes(k: str) -> {int}:
+        """
+        Returns the pitch classes of the scale of a key signature (natural minor for minor keys).
+        :param k: the key signature, e.g. 'Ebmaj' or 'Dm'
+        :return: the set of pitch classes
+        """
+        _, minor = ToneHelper.get_key(k)
+        shift = 3 if minor else 0  # scale_dict holds major scales, a minor key shares the scale of its relative major
+
+        return {(ToneHelper.pitch_class(note) + shift) % 12 for note in ToneHelper.scale_dict[ToneHelper.key_root(k)]}
+
+    @staticmethod
+    def key_scale(k: str) -> [str]:
+        """
+        Returns the note names of the scale of a key signature (natural minor for minor keys).
+        :param k: the key signature, e.g. 'Ebmaj' or 'F#m'
+        :return: the note names, starting on the tonic
+        """
+        sharps, minor = ToneHelper.get_key(k)
+        if not minor:
+            return ToneHelper.scale_dict[ToneHelper.key_root(k)]
+
+        # a minor key shares the scale of its relative major, a minor third up
+        major = ToneHelper.scale_dict[ToneHelper.name(ToneHelper.pitch_class(ToneHelper.key_root(k)) + 3,
+                                                      flats=sharps < 0)]
+        return major[5:] + major[:5]
+
+    @staticmethod
+    def spell(pc: int, k: str) -> str:
+        """
+        Spells a pitch class as a note name MidiWrite understands, following the key where possible.
+        Notes outside of the scale are spelled as a lowered scale degree in major keys (Eb and Bb in C major) and as a
+        raised one in minor keys (C# and G# in A minor), except for the raised fourth of a major key (F# in C major) and
+        the lowered second of a minor key (Bb in A minor).
+        :param pc: the pitch class
+        :param k: the key signature
+        :return: the note name
+        """
+        pc %= 12
+        scale = ToneHelper.key_scale(k)
+        for note in scale:
+            if note in ToneHelper.note_map and ToneHelper.pitch_class(note) == pc:
+                return note
+
+        sharps, minor = ToneHelper.get_key(k)
+        lowered = raised = None
+        for note in scale:
+            if ToneHelper.pitch_class(note) == (pc + 1) % 12:
+                lowered = note[:-1] if note.endswith("#") else note + "b"
+            elif ToneHelper.pitch_class(note) == (pc - 1) % 12:
+                raised = note[:-1] if note.endswith("b") else note + "#"
+
+        step = (pc - ToneHelper.pitch_class(scale[0])) % 12
+        prefer_raised = step != 1 if minor else step == 6
+        for note in ([raised, lowered] if prefer_raised else [lowered, raised]):
+            if note in ToneHelper.note_map:
+                return note
+
+        return ToneHelper.name(pc, flats=sharps < 0)
+
     @staticmethod
     def get_key(k: str):
         """
         Returns the number of sharps / flats for a given key.
         :param k: the key signature
         :return: the number of sharps / flats and if the key is major / minor
+        :raises ChordError: if the key signature is not a major or minor key MidiWrite knows
         """
 
         if "maj" in k:
-            for element in ToneHelper.major_keys:
-                if element == k[:2]:
-                    return ToneHelper.major_keys[element], 0
-            for element in ToneHelper.major_keys:
-                if element == k[0]:
-                    return ToneHelper.major_keys[element], 0
+            keys, minor = ToneHelper.major_keys, 0
         elif "m" in k:
-            for element in ToneHelper.minor_keys:
-                if element == k[:2]:
-                    return ToneHelper.minor_keys[element], 1
-            for element in ToneHelper.minor_keys:
-                if element == k[0]:
-                    return ToneHelper.minor_keys[element], 1
+            keys, minor = ToneHelper.minor_keys, 1
         else:
-            raise ValueError
+            raise ChordError("Key signature {} is neither major nor minor.".format(k))
+
+        for root in (k[:2], k[:1]):
+            if root in keys:
+                return keys[root], minor
+
+        raise ChordError("Key signature {} has an unknown root.".format(k))
 
     @staticmethod
     def shift_to_scale(shift: str, base: str) -> str:
         """
-        Shifts into a new key given a base note.
+        Shifts into a new key given a base note, spelled for output (see scale_degree for the pitch class).
         :param shift: the chord's tonic to shift to
         :param base: the original chord
         :return: the new key
@@ -141,35 +243,36 @@ class ToneHelper:
         return ToneHelper.scale_dict[base][ToneHelper.rn_scale[shift]]
 
     @staticmethod
-    def sharp_flat_shifted_note(sf: str, shift: str, base: str) -> str:
+    def scale_degree(shift: str, base: int) -> int:
+        """
+        Finds the pitch class of a degree of a major scale.
+        :param shift: roman numeral of the degree
+        :param base: pitch class of the tonic
+        :return: the pitch class of the degree
+        """
+        return (base + ToneHelper.major_steps[ToneHelper.rn_scale[shift]]) % 12
+
+    @staticmethod
+    def sharp_flat_shifted_note(sf: str, shift: str, base: int) -> int:
         """
         Shifts notes affected by accidentals.
         :param sf: number of sharps / flats
         :param shift: roman numeral number to shift
-        :param base: root key
-        :return: the note in corresponding key
+        :param base: pitch class of the root key
+        :return: the pitch class of the note
         """
-        note = None
+        degree = ToneHelper.rn_scale[shift]
 
         if sf == "bb":
-            note = ToneHelper.scale_dict[base][ToneHelper.rn_scale[shift] - 1]
+            return (base + ToneHelper.major_steps[(degree - 1) % 7]) % 12
         elif sf == "b":
-            note = ToneHelper.shift_to_scale(shift, base)
-            for i in range(len(ToneHelper.chromatic)):
-                if ToneHelper.chromatic[i][-2:] == note or ToneHelper.chromatic[i][:2] == note:
-                    return ToneHelper.chromatic[(i - 1 + 12) % 12][-2:]
+            return (base + ToneHelper.major_steps[degree] - 1) % 12
         elif sf == "##":
-            note = ToneHelper.scale_dict[base][ToneHelper.rn_scale[shift] + 1]
+            return (base + ToneHelper.major_steps[(degree + 1) % 7]) % 12
         elif sf == "#":
-            note = ToneHelper.shift_to_scale(shift, base)
-            for i in range(len(ToneHelper.chromatic)):
-                if ToneHelper.chromatic[i][:2] == note or ToneHelper.chromatic[i][-2:] == note:
-                    return ToneHelper.chromatic[(i + 1) % 12][:2]
+            return (base + ToneHelper.major_steps[degree] + 1) % 12
         else:
-            print("Error: shift " + sf + " not recognized")
-            exit(1)
-
-        return note
+            raise ChordError("shift " + sf + " not recognized")
 
     @staticmethod
     def cycle_of_mths(base: str, n: int, spacing: str='iv') -> [str]:
@@ -0,0 +1,242 @@
+# benchmarks for MidiWrite
+#
+# usage: python benchmark.py [benchmark](optional) [arguments](optional)
+# e.g.   python benchmark.py track-length 4 64 1024 16384 262144
+#        python benchmark.py parallel 1000000 1 2 4 8
+#        python benchmark.py batch 2000 64
+#        python benchmark.py pipeline 1000000 256 4
+#        python benchmark.py melody 1000000
+
+import filecmp
+import os
+import resource
+import sys
+import tempfile
+import time
+from midi_writer import MidiWrite
+from numpy_backend import NumpyBackend
+from pipeline import Pipeline
+from ToneHelper import ToneHelper
+from track_index import TrackIndex
+
+default_sizes = [4, 64, 1024, 16 * 1024]  # in KB, pass larger sizes (e.g. 262144) for long-form runs
+default_chords = 100_000
+
+melody = ["-e n:C4", "-e n:E4", "-s n:G4~C5", "-q n:B4", "-.e n:A4", "-s n:F4", "-e n:D4~G3", "-h n:C4"]
+
+progression = ["Cmaj7*", "-q Am7**", "-e Dm7***", "-a G7*", "-w Fmaj**", "-.q Em7*", "-s x32010", "-ar Bm7b5*"]
+
+
+def progression_of_size(target: int) -> [str]:
+    """
+    Builds a progression that renders to roughly the requested number of bytes.
+    :param target: the size of the track in bytes
+    :return: the commands of the progression
+    """
+    bytes_per_cycle = sum(sum(len(note) for note in MidiWrite.find_notes(chord)) for chord in progression)
+    cycles = max(1, target // bytes_per_cycle)
+
+    return progression * cycles
+
+
+def render(file: str, commands: [str], workers=1, index=False):
+    """
+    Renders a progression to a midi file with default settings.
+    :param file: the midi file to write to
+    :param commands: the commands of the progression
+    :param workers: number of processes encoding the track
+    :param index: also write the track index
+    :return: none
+    """
+    MidiWrite.write_preqs(file, time="4/4", tempo=120, ppq=96)
+    MidiWrite.write_track(file, commands, title="bench", arpeggiate=True, workers=workers, index=index)
+
+
+def verify(file: str) -> int:
+    """
+    Re-reads a rendered file and checks that every chunk length is consistent with its data.
+    :param file: the midi file to check
+    :return: the length of the longest track chunk
+    """
+    chunks = MidiWrite.read_chunks(file)
+
+    if [chunk_type for chunk_type, _, _ in chunks] != [MidiWrite.mthd, MidiWrite.mtrk, MidiWrite.mtrk]:
+        raise ValueError("unexpected chunk layout in {}".format(file))
+
+    with open(file, "rb") as f:
+        for chunk_type, offset, length in chunks[1:]:
+            f.seek(offset + length - 3)
+            if f.read(3) != b'\xff\x2f\x00':
+                raise ValueError("track at byte {} does not end with end-of-track".format(offset))
+
+    return max(length for _, _, length in chunks[1:])
+
+
+def bench_track_length(sizes: [int]):
+    """
+    Renders and re-reads progressions of increasing size.
+    :param sizes: the target track sizes in KB
+    :return: none
+    """
+    MidiWrite.ppq = MidiWrite.write_var_len(96)
+    MidiWrite.key_signature = "Cmaj"
+
+    print("{:>12} {:>12} {:>10} {:>10} {:>10}".format("target KB", "track bytes", "render s", "verify s", "MB/s"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        file = os.path.join(directory, "bench.midi")
+
+        for size in sizes:
+            commands = progression_of_size(size * 1024)
+
+            start = time.perf_counter()
+            render(file, commands)
+            rendered = time.perf_counter()
+            track_length = verify(file)
+            verified = time.perf_counter()
+
+            print("{:>12} {:>12} {:>10.3f} {:>10.3f} {:>10.2f}".format(
+                size, track_length, rendered - start, verified - rendered,
+                track_length / (1024 * 1024) / (rendered - start)))
+
+            os.remove(file)
+
+
+def bench_parallel(args: [str]):
+    """
+    Renders the same progression with an increasing number of worker processes, with and without the track index,
+    and checks the output is identical.
+    :param args: the number of chords, followed by the worker counts to try
+    :return: none
+    """
+    chords = int(args[0]) if args else default_chords
+    worker_counts = [int(workers) for workers in args[1:]] or [1, 2, 4, os.cpu_count()]
+    commands = (progression * (chords // len(progression) + 1))[:chords]
+
+    print("{} cores".format(os.cpu_count()))
+    print("{:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "workers", "index", "render s", "speedup", "identical", "max RSS MB"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        reference = os.path.join(directory, "reference.midi")
+        file = os.path.join(directory, "bench.midi")
+
+        for index in (False, True):
+            start = time.perf_counter()
+            render(reference, commands, index=index)
+            sequential = time.perf_counter() - start
+
+            for workers in worker_counts:
+                start = time.perf_counter()
+                render(file, commands, workers=workers, index=index)
+                elapsed = time.perf_counter() - start
+
+                identical = filecmp.cmp(reference, file, shallow=False)
+                if index:
+                    identical = identical and filecmp.cmp(reference + TrackIndex.extension, file + TrackIndex.extension,
+                                                          shallow=False)
+                print("{:>10} {:>10} {:>10.3f} {:>10.2f} {:>10} {:>10.1f}".format(
+                    workers, str(index), elapsed, sequential / elapsed, str(identical),
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def bench_batch(args: [str]):
+    """
+    Encodes a batch of transposed progressions with the numpy backend and in pure Python.
+    :param args: the number of progressions and their length
+    :return: none
+    """
+    batch = int(args[0]) if args else 1000
+    length = int(args[1]) if len(args) > 1 else 64
+
+    MidiWrite.ppq = MidiWrite.write_var_len(96)
+    MidiWrite.key_signature = "Cmaj"
+
+    shapes = list(ToneHelper.chord_dict)
+    roots = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"]
+    flags = ["", "-w ", "-q ", "-e "]
+    progressions = [[flags[(i + n) % len(flags)] + roots[(i * 7 + n) % len(roots)] + shapes[n % len(shapes)]
+                     for n in range(length)] for i in range(batch)]
+
+    start = time.perf_counter()
+    encoded = NumpyBackend.encode_batch(progressions)
+    vectorized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = [b''.join(MidiWrite.encode_commands(progression)) for progression in progressions]
+    sequential = time.perf_counter() - start
+
+    print("{:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "batch", "length", "numpy s", "python s", "speedup", "identical"))
+    print("{:>10} {:>10} {:>10.3f} {:>10.3f} {:>10.2f} {:>10}".format(
+        batch, length, vectorized, sequential, sequential / vectorized, str(encoded == reference)))
+
+
+def bench_pipeline(args: [str]):
+    """
+    Renders a progression through the pipeline, compares it to a regular render and reports each stage.
+    :param args: the number of chords, the batch size and the queue depth
+    :return: none
+    """
+    chords = int(args[0]) if args else default_chords
+    batch_size = int(args[1]) if len(args) > 1 else 256
+    depth = int(args[2]) if len(args) > 2 else 4
+    commands = (progression * (chords // len(progression) + 1))[:chords]
+
+    with tempfile.TemporaryDirectory() as directory:
+        reference = os.path.join(directory, "reference.midi")
+        file = os.path.join(directory, "bench.midi")
+
+        start = time.perf_counter()
+        render(reference, commands)
+        sequential = time.perf_counter() - start
+
+        pipeline = Pipeline(batch_size=batch_size, depth=depth)
+        start = time.perf_counter()
+        MidiWrite.write_preqs(file, time="4/4", tempo=120, ppq=96)
+        pipeline.write_track(file, iter(commands), title="bench", arpeggiate=True)
+        pipelined = time.perf_counter() - start
+
+        print(pipeline.report())
+        print()
+        print("{:>10} {:>10} {:>10} {:>10}".format("render s", "pipeline s", "speedup", "identical"))
+        print("{:>10.3f} {:>10.3f} {:>10.2f} {:>10}".format(
+            sequential, pipelined, sequential / pipelined, str(filecmp.cmp(reference, file, shallow=False))))
+
+
+def bench_melody(args: [str]):
+    """
+    Renders a long melodic line of single notes and scale runs.
+    :param args: the number of commands
+    :return: none
+    """
+    commands = int(args[0]) if args else default_chords
+    line = (melody * (commands // len(melody) + 1))[:commands]
+
+    with tempfile.TemporaryDirectory() as directory:
+        file = os.path.join(directory, "bench.midi")
+
+        start = time.perf_counter()
+        MidiWrite.write_preqs(file, time="4/4", tempo=120, ppq=96)
+        MidiWrite.write_track(file, line, title="bench")
+        elapsed = time.perf_counter() - start
+        track_length = verify(file)
+
+    print("{:>10} {:>12} {:>10} {:>10}".format("commands", "track bytes", "render s", "MB/s"))
+    print("{:>10} {:>12} {:>10.3f} {:>10.2f}".format(
+        commands, track_length, elapsed, track_length / (1024 * 1024) / elapsed))
+
+
+benchmarks = {
+    "track-length": lambda args: bench_track_length([int(size) for size in args] or default_sizes),
+    "parallel": bench_parallel,
+    "batch": bench_batch,
+    "pipeline": bench_pipeline,
+    "melody": bench_melody,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in benchmarks:
+        benchmarks[sys.argv[1]](sys.argv[2:])
+    else:
+        benchmarks["track-length"](sys.argv[1:])
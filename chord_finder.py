@@ -0,0 +1,109 @@
+# reverse chord lookup: from notes back to chord names and roman numerals
+
+from ToneHelper import ToneHelper
+
+# offset of the root for each root-string marker, as used by MidiWrite.chord_shape
+marker_offsets = {"*": 0, "**": 12, "***": 24}
+
+roman_numerals = ["i", "ii", "iii", "iv", "v", "vi", "vii"]
+
+
+class ChordFinder:
+    def __init__(self, key="Cmaj"):
+        """
+        Builds the reverse index of every chord in ToneHelper.chord_dict for a key.
+        Chords are indexed by their pitch-class set (as a 12-bit mask) together with the pitch class of the bass note,
+        and by the pitch-class set alone for voicings the dictionary does not contain.
+        :param key: the key signature used for spelling and roman numerals
+        """
+        self.key = key
+        self.by_bass = {}  # (bass pitch class, mask) -> (root pitch class, chord type)
+        self.by_set = {}   # mask -> (root pitch class, chord type)
+        self.found = {}    # notes -> result of identify, imports repeat the same voicings over and over
+
+        # every root string plays the single-* voicing, an octave higher for each marker
+        for shape, intervals in ToneHelper.chord_dict.items():
+            c_type = shape.rstrip("*")
+            if shape != c_type + "*":
+                continue
+
+            for root in range(12):
+                mask = ChordFinder.mask(root + i for i in intervals)
+                self.by_bass.setdefault(((root + min(intervals)) % 12, mask), (root, c_type))
+                self.by_set.setdefault(mask, (root, c_type))
+
+        self.degrees = {}  # pitch class -> scale degree
+        for degree, note in enumerate(ToneHelper.scale_dict[ToneHelper.key_root(key)]):
+            self.degrees[ToneHelper.pitch_class(note)] = degree
+
+    @staticmethod
+    def mask(notes) -> int:
+        """
+        Normalises notes to a pitch-class set.
+        :param notes: the midi notes
+        :return: 12-bit mask with bit n set if pitch class n is present
+        """
+        mask = 0
+        for note in notes:
+            mask |= 1 << (note % 12)
+        return mask
+
+    def numeral(self, root: int, c_type: str) -> str:
+        """
+        Writes a chord as a roman numeral MidiWrite's rn_mode resolves back to the same chord.
+        :param root: the pitch class of the root
+        :param c_type: the chord type
+        :return: the roman numeral, or None if the chord cannot be written as one
+        """
+        if root not in self.degrees or "b" in c_type or "#" in c_type:
+            return None
+
+        numeral = roman_numerals[self.degrees[root]]
+        if c_type.startswith("maj"):
+            return numeral.upper() + c_type[3:]
+        elif c_type == "13":
+            return numeral.upper() + c_type
+        elif c_type.startswith("m"):
+            return numeral + c_type[1:]
+
+        return None
+
+    def marker(self, root_name: str, c_type: str, lowest: int) -> str:
+        """
+        Picks the root-string marker whose voicing starts closest to the lowest note played.
+        :param root_name: the spelled root of the chord
+        :param c_type: the chord type
+        :param lowest: the lowest midi note played
+        :return: the root-string marker
+        """
+        base = ToneHelper.note_map[root_name] + min(ToneHelper.chord_dict[c_type + "*"])
+
+        return min(marker_offsets, key=lambda m: abs(base + marker_offsets[m] - lowest))
+
+    def identify(self, notes: [int]) -> (str, str):
+        """
+        Identifies the chord formed by a set of notes.
+        :param notes: the midi notes
+        :return: (chord name, roman numeral) including the root-string marker; the numeral is None if the chord
+                 cannot be written as one, and None is returned if the chord is not in the dictionary
+        """
+        if not notes:
+            return None
+
+        voicing = tuple(sorted(notes))
+        if voicing in self.found:
+            return self.found[voicing]
+
+        mask = ChordFinder.mask(notes)
+        entry = self.by_bass.get((voicing[0] % 12, mask)) or self.by_set.get(mask)
+        chord = None
+
+        if entry is not None:
+            root, c_type = entry
+            root_name = ToneHelper.spell(root, self.key)
+            marker = self.marker(root_name, c_type, voicing[0])
+            numeral = self.numeral(root, c_type)
+            chord = root_name + c_type + marker, (numeral + marker if numeral is not None else None)
+
+        self.found[voicing] = chord
+        return chord
@@ -0,0 +1,197 @@
+# compiled index for custom chord / pattern files
+#
+# usage: python chord_index.py [custom file] [index file](optional)
+#
+# The index is a single binary file that is memory-mapped by the renderer:
+#
+#   header   magic 'MWCI', version, record count
+#   records  one fixed-width record per entry, sorted by key:
+#            key offset, key length, value offset, value length, kind
+#   blob     keys and values; intervals are packed as signed bytes, fret notation and patterns as ascii
+#
+# Looking up an entry is a binary search over the records, so opening an index costs the same no matter how many
+# chords it holds, and processes rendering with the same index share its pages.
+
+import array
+import mmap
+import struct
+import sys
+
+
+class ChordIndex:
+    magic = b'MWCI'
+    version = 1
+
+    header = struct.Struct(">4sHI")     # magic, version, number of records
+    record = struct.Struct(">IHIHB")    # key offset, key length, value offset, value length, kind
+
+    # kinds of entries
+    kind_intervals = 0
+    kind_fret = 1
+    kind_pattern = 2
+
+    def __init__(self, buffer, source=None):
+        """
+        Wraps a compiled index.
+        :param buffer: the compiled index (bytes or a memory map)
+        :param source: the file the index was loaded from
+        """
+        magic, version, count = ChordIndex.header.unpack_from(buffer, 0)
+        if magic != ChordIndex.magic or version != ChordIndex.version:
+            raise ValueError("{} is not a compiled chord index".format(source))
+
+        self.buffer = buffer
+        self.source = source
+        self.count = count
+
+    @staticmethod
+    def open(file: str):
+        """
+        Opens a custom file, memory-mapping it if it is compiled and compiling it in memory otherwise.
+        :param file: the custom file or compiled index
+        :return: the index
+        """
+        with open(file, "rb") as f:
+            compiled = f.read(len(ChordIndex.magic)) == ChordIndex.magic
+            if compiled:
+                return ChordIndex(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), file)
+
+        with open(file, "r") as f:
+            return ChordIndex(ChordIndex.build(ChordIndex.parse(f)), file)
+
+    @staticmethod
+    def chord_key(name: str) -> str:
+        """
+        Normalises a custom chord name, e.g. 'F7%[2]' and 'F7%2' are the same chord.
+        :param name: the chord name
+        :return: the key of the chord
+        """
+        return name.replace("[", "").replace("]", "").replace(" ", "")
+
+    @staticmethod
+    def parse(lines) -> dict:
+        """
+        Parses the definitions of a custom file.
+        Chords look like <chord>%[i]:<notes> or <chord>%[i]:<fret notation>, patterns like "[time_sig]:[no]";"[pattern]".
+        :param lines: the lines of the custom file
+        :return: dictionary of key -> (kind, value)
+        """
+        entries = {}
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            if ";" in line:
+                key, value = [part.strip().replace("\"", "") for part in line.split(";", 1)]
+                entries[key] = (ChordIndex.kind_pattern, value)
+                continue
+
+            name, value = [part.strip() for part in line.split(":", 1)]
+            if 'x' in value or (value.isdigit() and len(value) == 6):
+                entries[ChordIndex.chord_key(name)] = (ChordIndex.kind_fret, value)
+            else:
+                entries[ChordIndex.chord_key(name)] = (ChordIndex.kind_intervals, [int(i) for i in value.split(",")])
+
+        return entries
+
+    @staticmethod
+    def build(entries: dict) -> bytes:
+        """
+        Packs parsed definitions into a compiled index.
+        :param entries: dictionary of key -> (kind, value)
+        :return: the compiled index
+        """
+        keys = sorted(entries, key=lambda k: k.encode())
+        blob_start = ChordIndex.header.size + ChordIndex.record.size * len(keys)
+
+        records = bytearray()
+        blob = bytearray()
+        for key in keys:
+            kind, value = entries[key]
+            key_bytes = key.encode()
+            value_bytes = array.array('b', value).tobytes() if kind == ChordIndex.kind_intervals else value.encode()
+
+            key_offset = blob_start + len(blob)
+            blob += key_bytes
+            value_offset = blob_start + len(blob)
+            blob += value_bytes
+
+            records += ChordIndex.record.pack(key_offset, len(key_bytes), value_offset, len(value_bytes), kind)
+
+        return ChordIndex.header.pack(ChordIndex.magic, ChordIndex.version, len(keys)) + bytes(records) + bytes(blob)
+
+    @staticmethod
+    def compile(custom_file: str, index_file: str):
+        """
+        Compiles a custom file into an index file.
+        :param custom_file: the custom chord / pattern file
+        :param index_file: the index file to write
+        :return: the number of entries compiled
+        """
+        with open(custom_file, "r") as f:
+            entries = ChordIndex.parse(f)
+
+        with open(index_file, "wb") as f:
+            f.write(ChordIndex.build(entries))
+
+        return len(entries)
+
+    def find(self, key: str) -> (int, bytes):
+        """
+        Binary searches the records for a key.
+        :param key: the key to look for
+        :return: (kind, raw value) of the entry, or None if it is not in the index
+        """
+        target = key.encode()
+        low, high = 0, self.count
+
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, key_length, value_offset, value_length, kind = ChordIndex.record.unpack_from(
+                self.buffer, ChordIndex.header.size + middle * ChordIndex.record.size)
+            candidate = self.buffer[key_offset:key_offset + key_length]
+
+            if candidate == target:
+                return kind, self.buffer[value_offset:value_offset + value_length]
+            elif candidate < target:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def chord(self, name: str):
+        """
+        Looks up a custom chord.
+        :param name: the chord name, e.g. '7%' or '7%[2]'
+        :return: the chord's intervals, its fret notation, or None if it is not defined
+        """
+        entry = self.find(ChordIndex.chord_key(name))
+        if entry is None or entry[0] == ChordIndex.kind_pattern:
+            return None
+
+        kind, value = entry
+        if kind == ChordIndex.kind_intervals:
+            return array.array('b', value).tolist()
+        return value.decode()
+
+    def pattern(self, key: str) -> str:
+        """
+        Looks up a custom pattern.
+        :param key: the pattern key, e.g. '4/4:5'
+        :return: the pattern, or None if it is not defined
+        """
+        entry = self.find(key)
+        if entry is None or entry[0] != ChordIndex.kind_pattern:
+            return None
+
+        return entry[1].decode()
+
+
+if __name__ == "__main__":
+    source = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) > 2 else source.rsplit(".", 1)[0] + ".mwci"
+
+    print("Compiled {} entries from {} into {}".format(ChordIndex.compile(source, target), source, target))
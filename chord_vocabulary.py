@@ -0,0 +1,189 @@
+# chord vocabulary built from interval formulas
+#
+# Chord types are not listed anywhere: a name such as "m9", "7#9", "maj7#11", "add9", "6/9", "9sus4" or "7/G" is
+# parsed into its chord tones the first time it is asked for, and its voicing for each root string is worked out on a
+# guitar in standard tuning. Both are memoized, so a vocabulary of any size costs nothing until a chord type is used,
+# and one dictionary lookup after that. The hand-written voicings in ToneHelper.chord_dict take precedence.
+
+import itertools
+import re
+from ToneHelper import ToneHelper
+
+# semitones above the root of each scale degree
+degrees = {"1": 0, "2": 2, "3": 4, "4": 5, "5": 7, "6": 9, "7": 11, "9": 14, "11": 17, "13": 21}
+
+# [quality][extension][sus][alterations][adds][no3 / no5][/bass], e.g. "m7b5", "maj9#11", "7sus4", "add9", "m7/G"
+type_pattern = re.compile(r'^(?P<quality>maj|M|mM|min|m|dim|o|aug|\+|ø|5)?(?P<extension>6/9|6|7|9|11|13)?'
+                          r'(?P<sus>sus[24]?)?(?P<alterations>(?:[b#](?:5|9|11|13))*)(?P<adds>(?:add(?:2|4|9|11|13))*)'
+                          r'(?:no(?P<omit>[35]))?(?:/(?P<bass>[A-G][#b]?))?$')
+
+# which chord tones to keep when there are more tones than strings: third, seventh, altered tones, extensions, fifth
+ranks = {"3": 0, "sus": 0, "7": 1, "6": 1, "13": 3, "11": 4, "9": 5, "2": 5, "4": 5, "5": 6, "1": 7}
+altered_rank = 2
+
+tuning = [40, 45, 50, 55, 59, 64]  # standard tuning, low E to high E
+root_strings = {"*": 0, "**": 1, "***": 2}
+frets = range(-1, 4)  # frets a hand can reach around the root fret
+
+
+class ChordVocabulary:
+    formulas = {}  # chord type -> (chord tones, bass note) or None
+    voicings = {}  # (chord type, root-string marker) -> intervals or None
+
+    @staticmethod
+    def formula(c_type: str) -> ({str: int}, str):
+        """
+        Works out the chord tones of a chord type.
+        :param c_type: the chord type, e.g. 'm7b5'
+        :return: (dictionary of degree -> semitones above the root, bass note of a slash chord or None), or None if the
+                 chord type cannot be read
+        """
+        if c_type in ChordVocabulary.formulas:
+            return ChordVocabulary.formulas[c_type]
+
+        match = type_pattern.match(c_type)
+        if match is None:
+            ChordVocabulary.formulas[c_type] = None
+            return None
+
+        quality, extension, sus, alterations, adds, omit, bass = match.groups()
+        tones = {"1": 0, "3": 4, "5": 7}
+
+        if quality in ("m", "min", "mM"):
+            tones["3"] = 3
+        elif quality in ("dim", "o", "ø"):
+            tones["3"], tones["5"] = 3, 6
+        elif quality in ("aug", "+"):
+            tones["5"] = 8
+        elif quality == "5":
+            del tones["3"]
+
+        if quality in ("maj", "M", "mM"):
+            seventh = 11
+        elif quality in ("dim", "o"):
+            seventh = 9  # diminished seventh
+        else:
+            seventh = 10
+
+        if quality == "ø":
+            tones["7"] = 10
+        if extension == "6":
+            tones["6"] = degrees["6"]
+        elif extension == "6/9":
+            tones["6"], tones["9"] = degrees["6"], degrees["9"]
+        elif extension is not None:
+            tones["7"] = seventh
+            for degree in ["9", "11", "13"]:
+                if int(degree) <= int(extension):
+                    tones[degree] = degrees[degree]
+            if extension == "13" and tones.get("3") == 4:
+                del tones["11"]  # the eleventh clashes with a major third
+
+        if sus is not None:
+            tones.pop("3", None)
+            tones["sus"] = degrees["2"] if sus == "sus2" else degrees["4"]
+
+        for accidental, degree in re.findall(r'([b#])(5|9|11|13)', alterations):
+            tones.pop(degree, None)
+            tones[accidental + degree] = degrees[degree] + (1 if accidental == "#" else -1)
+
+        for degree in re.findall(r'add(\d+)', adds):
+            tones[degree] = degrees[degree]
+
+        if omit is not None:
+            tones.pop(omit, None)
+
+        ChordVocabulary.formulas[c_type] = tones, bass
+        return ChordVocabulary.formulas[c_type]
+
+    @staticmethod
+    def voicing(c_type: str, marker: str) -> [int]:
+        """
+        Voices a chord type from a root string.
+        The root is played on the root string and every higher string either plays a chord tone within reach of the
+        root fret or is muted. Of all such voicings, the one covering the most important chord tones wins; ties go to
+        fuller voicings without muted strings in between, repeated notes or stretches behind the root fret.
+        :param c_type: the chord type
+        :param marker: the root-string marker
+        :return: the intervals of the notes above the root, lowest string first, or None if the chord type cannot be read
+        """
+        key = (c_type, marker)
+        if key in ChordVocabulary.voicings:
+            return ChordVocabulary.voicings[key]
+
+        formula = ChordVocabulary.formula(c_type)
+        if formula is None or marker not in root_strings:
+            ChordVocabulary.voicings[key] = None
+            return None
+
+        tones, _ = formula
+        labels = {}  # pitch class -> chord tone
+        for label, semitones in sorted(tones.items(), key=lambda tone: ChordVocabulary.rank(tone[0])):
+            labels.setdefault(semitones % 12, label)
+
+        root_string = root_strings[marker]
+        options = []
+        for string in range(root_string + 1, len(tuning)):
+            offset = tuning[string] - tuning[root_string]
+            options.append([None] + [(offset + fret, fret) for fret in frets if (offset + fret) % 12 in labels])
+
+        best, best_score = None, None
+        for choice in itertools.product(*options):
+            score = ChordVocabulary.score([(0, 0)] + list(choice), labels)
+            if best_score is None or score > best_score:
+                best, best_score = choice, score
+
+        ChordVocabulary.voicings[key] = [0] + [note[0] for note in best if note is not None]
+        return ChordVocabulary.voicings[key]
+
+    @staticmethod
+    def rank(label: str) -> int:
+        """
+        Returns how important a chord tone is (0 is most important).
+        :param label: the chord tone, e.g. '3' or 'b9'
+        :return: the rank
+        """
+        return altered_rank if label[0] in "b#" else ranks[label]
+
+    @staticmethod
+    def score(choice: [(int, int)], labels: {int: str}) -> int:
+        """
+        Scores a voicing.
+        :param choice: the interval and fret (relative to the root fret) on each string from the root string up, or None
+                       if the string is muted
+        :param labels: pitch class -> chord tone
+        :return: the score (higher is better)
+        """
+        played = [note[0] for note in choice if note is not None]
+        covered = {labels[interval % 12] for interval in played}
+
+        # each chord tone outweighs all less important ones together
+        score = sum(2 ** (10 - ChordVocabulary.rank(label)) * 100 for label in covered)
+        score += 10 * len(played)
+
+        last = max(i for i, note in enumerate(choice) if note is not None)
+        score -= 40 * sum(1 for note in choice[:last] if note is None)          # muted strings in between
+        score -= 30 * (len(played) - len(set(played)))                         # the same note twice
+        score -= 20 * sum(1 for low, high in zip(played, played[1:]) if high < low)
+        score -= 15 * sum(1 for note in choice if note is not None and note[1] < 0)
+
+        return score
+
+    @staticmethod
+    def shape(root: str, c_type: str, marker: str) -> [int]:
+        """
+        Returns the intervals of a chord, with the bass note of a slash chord below the voicing.
+        :param root: the root of the chord
+        :param c_type: the chord type
+        :param marker: the root-string marker
+        :return: the intervals above the root, or None if the chord type cannot be read
+        """
+        intervals = ChordVocabulary.voicing(c_type, marker)
+        if intervals is None:
+            return None
+
+        bass = ChordVocabulary.formulas[c_type][1]
+        if bass is None:
+            return intervals
+
+        return [(ToneHelper.pitch_class(bass) - ToneHelper.pitch_class(root)) % 12 - 12] + intervals
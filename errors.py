@@ -0,0 +1,63 @@
+# errors raised for bad input
+#
+# They are ValueErrors, so code catching ValueError keeps working. A render does not stop at a bad command: the error
+# is recorded in MidiWrite.diagnostics and a placeholder note is written in its place.
+
+
+class MidiWriteError(ValueError):
+    """
+    Base class of the errors raised for bad input.
+    """
+    def __init__(self, message: str, command=None):
+        """
+        :param message: what is wrong
+        :param command: the command it is wrong in, if any
+        """
+        super().__init__(message)
+        self.command = command
+
+
+class FlagError(MidiWriteError):
+    """
+    Raised for conflicting command flags, e.g. two time flags.
+    """
+    pass
+
+
+class ChordError(MidiWriteError):
+    """
+    Raised for a chord that cannot be resolved to notes.
+    """
+    pass
+
+
+class NoteError(MidiWriteError):
+    """
+    Raised for notes outside of the midi range.
+    """
+    pass
+
+
+class SectionError(MidiWriteError):
+    """
+    Raised for references to sections that are not defined or that repeat themselves.
+    """
+    pass
+
+
+class MarkupError(MidiWriteError):
+    """
+    Raised for malformed markup files.
+    """
+    def __init__(self, message: str, file=None, line=None):
+        """
+        :param message: what is wrong
+        :param file: the markup file
+        :param line: the line it is wrong on, counting from 1
+        """
+        super().__init__(message)
+        self.file = file
+        self.line = line
+
+    def __str__(self):
+        return "Error in [{}]: {} [line: {}]".format(self.file, self.args[0], self.line)
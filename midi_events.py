@@ -0,0 +1,58 @@
+# reading and writing the pieces of a midi track shared by the importer, the splicer and the track index
+#
+# Delta times and meta/sysex lengths are variable-length quantities: seven bits per byte, most significant first, with
+# the top bit set on every byte but the last. MidiWrite.write_var_len keeps its own encoding (it pads one-byte values
+# with a leading 0), everything that reads tracks goes through here.
+
+
+class MidiEvents:
+    @staticmethod
+    def read_var_len(data, pos: int) -> (int, int):
+        """
+        Reads a variable-length quantity.
+        :param data: the track data
+        :param pos: the position of the quantity
+        :return: the value and the position after it
+        """
+        value = 0
+        while True:
+            c = data[pos]
+            pos += 1
+            value = (value << 7) | (c & 0x7f)
+            if not c & 0x80:
+                return value, pos
+
+    @staticmethod
+    def write_var_len(n: int) -> bytes:
+        """
+        Encodes a delta time as a variable-length quantity in as few bytes as possible.
+        :param n: the delta time
+        :return: the variable-length quantity
+        """
+        out = bytearray([n & 0x7f])
+        n >>= 7
+        while n:
+            out.insert(0, (n & 0x7f) | 0x80)
+            n >>= 7
+
+        return bytes(out)
+
+    @staticmethod
+    def event_end(data, pos: int, kind: int) -> (int, int):
+        """
+        Skips over the body of an event.
+        :param data: the track data
+        :param pos: the position after the status byte
+        :param kind: the status of the event
+        :return: the meta type (None if not a meta event) and the position after the event
+        """
+        if kind == 0xff:
+            length, end = MidiEvents.read_var_len(data, pos + 1)
+            return data[pos], end + length
+        elif kind in (0xf0, 0xf7):
+            length, end = MidiEvents.read_var_len(data, pos)
+            return None, end + length
+        elif kind & 0xf0 in (0xc0, 0xd0):
+            return None, pos + 1
+
+        return None, pos + 2
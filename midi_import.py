@@ -0,0 +1,253 @@
+# turns MIDI files back into MidiWrite markup files
+#
+# usage: python midi_import.py [midi file] [mode](optional, cn_mode / rn_mode) [key](optional)
+
+import struct
+import sys
+from chord_finder import ChordFinder
+from errors import ChordError
+from midi_events import MidiEvents
+from midi_writer import MidiWrite
+from ToneHelper import ToneHelper
+
+# time flags and their length in quarter notes (no flag is a half note)
+durations = [("-o", 8), ("-.w", 6), ("-w", 4), ("-.h", 3), ("", 2), ("-.q", 1.5), ("-q", 1), ("-.e", 0.75),
+             ("-e", 0.5), ("-.s", 0.375), ("-s", 0.25), ("-.t", 0.1875), ("-t", 0.125)]
+
+
+class MidiImport:
+    @staticmethod
+    def read_events(file: str) -> (int, dict, [(int, int, int)]):
+        """
+        Reads the notes and settings of a midi file.
+        :param file: the midi file
+        :return: the ppq, the settings found in meta events (tempo, time-sig, key-sig) and a list of
+                 (tick, on, note) events from every track, sorted by tick with note-offs first
+        """
+        with open(file, "rb") as f:
+            data = f.read()
+
+        ppq = 96
+        settings = {}
+        events = []
+
+        for chunk_type, offset, length in MidiWrite.read_chunks(file):
+            if chunk_type == MidiWrite.mthd:
+                ppq = struct.unpack(">H", data[offset + 4:offset + 6])[0]
+                continue
+
+            pos, end, tick, status = offset, offset + length, 0, 0
+            while pos < end:
+                delta, pos = MidiEvents.read_var_len(data, pos)
+                tick += delta
+
+                if data[pos] & 0x80:
+                    status = data[pos]
+                    pos += 1
+
+                if status == 0xff:
+                    meta_type = data[pos]
+                    meta_length, pos = MidiEvents.read_var_len(data, pos + 1)
+                    meta = data[pos:pos + meta_length]
+                    pos += meta_length
+
+                    if meta_type == 0x51:
+                        settings["tempo"] = round(60_000_000 / int.from_bytes(meta, "big"))
+                    elif meta_type == 0x58:
+                        settings["time-sig"] = "{}/{}".format(meta[0], 2 ** meta[1])
+                    elif meta_type == 0x59:
+                        sf = meta[0] - 256 if meta[0] > 127 else meta[0]
+                        keys = ToneHelper.minor_keys if meta[1] else ToneHelper.major_keys
+                        for name, count in keys.items():
+                            if count == sf:
+                                settings["key-sig"] = name + ("m" if meta[1] else "maj")
+                                break
+                    elif meta_type == 0x2f:
+                        break
+                elif status in (0xf0, 0xf7):
+                    sysex_length, pos = MidiEvents.read_var_len(data, pos)
+                    pos += sysex_length
+                elif status & 0xf0 in (0xc0, 0xd0):
+                    pos += 1
+                else:
+                    kind, channel = status & 0xf0, status & 0x0f
+                    note, velocity = data[pos], data[pos + 1]
+                    pos += 2
+
+                    if channel != 9 and kind in (0x80, 0x90):  # channel 10 is percussion
+                        events.append((tick, kind == 0x90 and velocity > 0, note))
+
+        events.sort(key=lambda event: (event[0], event[1]))
+        return ppq, settings, events
+
+    @staticmethod
+    def chords(events: [(int, int, int)]) -> [(int, [int])]:
+        """
+        Groups note events into chords. A chord is every note started while another note of it is still sounding;
+        it lasts until the next chord starts.
+        :param events: the (tick, on, note) events, sorted
+        :return: list of (length in ticks, notes)
+        """
+        chords = []
+        sounding = 0
+        start = None
+        last = 0
+        notes = []
+
+        for tick, on, note in events:
+            if on:
+                if sounding == 0:
+                    if start is not None:
+                        chords.append((tick - start, notes))
+                    start = tick
+                    notes = []
+                notes.append(note)
+                sounding += 1
+            elif sounding > 0:
+                sounding -= 1
+                last = tick
+
+        if start is not None:
+            chords.append((max(last - start, 0), notes))
+
+        return chords
+
+    @staticmethod
+    def time_flag(ticks: int, ppq: int) -> str:
+        """
+        Finds the time flag closest to a length.
+        :param ticks: the length in ticks
+        :param ppq: the parts per quarter
+        :return: the time flag ('' for the default half note)
+        """
+        return min(durations, key=lambda duration: abs(duration[1] * ppq - ticks))[0]
+
+    @staticmethod
+    def custom_chord(notes: [int], key: str, custom: {(int,): str}) -> str:
+        """
+        Writes notes that are not a chord in the chord dictionary (or the single notes of an arpeggio) as a custom chord,
+        so they are played as they are.
+        :param notes: the midi notes
+        :param key: the key to spell the root in
+        :param custom: intervals -> name of the custom chords defined so far, added to if the voicing is new
+        :return: the command, e.g. 'Eb%[3]'
+        """
+        lowest = min(notes)
+        root = ToneHelper.spell(lowest % 12, key)
+        # custom chords are played from the root in the note map's octave
+        intervals = tuple(note - ToneHelper.note_map[root] for note in sorted(notes))
+
+        if intervals not in custom:
+            custom[intervals] = "%[{}]".format(len(custom) + 1)
+
+        return root + custom[intervals]
+
+    @staticmethod
+    def to_commands(file: str, mode="cn_mode", key=None) -> (dict, [str], {(int,): str}):
+        """
+        Converts a midi file into MidiWrite commands.
+        Notes that are not a chord in the chord dictionary are written as custom chords, so every chord keeps its place
+        in time; each such voicing is reported once in MidiWrite.diagnostics.
+        :param file: the midi file
+        :param mode: the type of chords to write (normal / roman numeral)
+        :param key: the key to name chords in (defaults to the key signature of the file)
+        :return: the settings of the file, its commands and the custom chords they use (intervals -> name)
+        """
+        ppq, settings, events = MidiImport.read_events(file)
+        settings["ppq"] = ppq
+        settings["key-sig"] = key or settings.get("key-sig", "Cmaj")
+        settings["mode"] = mode
+
+        finder = ChordFinder(settings["key-sig"])
+        chords = []
+        flags = {}  # ticks -> time flag
+        custom = {}
+        MidiWrite.diagnostics = []
+
+        for ticks, notes in MidiImport.chords(events):
+            chord = finder.identify(notes)
+            if chord is None:
+                defined = len(custom)
+                command = MidiImport.custom_chord(notes, settings["key-sig"], custom)
+                if len(custom) > defined:
+                    MidiWrite.report(ChordError("notes {} are not a chord in the chord dictionary, written as a custom "
+                                                "chord".format(sorted(notes)), command), command)
+                chord = command, command  # custom chords read the same in rn_mode
+
+            if ticks not in flags:
+                flags[ticks] = MidiImport.time_flag(ticks, ppq)
+            chords.append((flags[ticks], chord))
+
+        # rn_mode reads every command as a roman numeral, so it can only be used if every chord has one
+        use_numerals = mode == "rn_mode" and all(numeral is not None for _, (_, numeral) in chords)
+        if mode == "rn_mode" and not use_numerals:
+            print("Not every chord in {} can be written as a roman numeral, using cn_mode.".format(file))
+            settings["mode"] = "cn_mode"
+
+        commands = []
+        for flag, (name, numeral) in chords:
+            name = numeral if use_numerals else name
+            commands.append(flag + " " + name if flag else name)
+
+        return settings, commands, custom
+
+    @staticmethod
+    def write_custom(file: str, custom: {(int,): str}):
+        """
+        Writes custom chords to a custom file.
+        :param file: the custom file
+        :param custom: intervals -> name of each custom chord
+        :return: none
+        """
+        with open(file, "w") as f:
+            for intervals, name in custom.items():
+                f.write("{}:{}\n".format(name, ",".join(str(i) for i in intervals)))
+
+    @staticmethod
+    def write_mwm(file: str, title: str, settings: dict, commands: [str], per_line=4, custom_file=None):
+        """
+        Writes commands to a markup file.
+        :param file: the markup file
+        :param title: the title of the progression
+        :param settings: the prefix settings (time-sig, tempo, key-sig, mode, ppq)
+        :param commands: the commands
+        :param per_line: number of commands per line
+        :param custom_file: the custom file the commands use, if any
+        :return: none
+        """
+        lines = ["\"" + "\", \"".join(commands[i:i + per_line]) + "\"" for i in range(0, len(commands), per_line)]
+
+        with open(file, "w") as f:
+            f.write("<begin {}>\n".format(title))
+            f.write("       <prefix>\n")
+            for setting in ["time-sig", "tempo", "key-sig", "mode", "ppq"]:
+                if setting in settings:
+                    f.write("           <{}={}>\n".format(setting, settings[setting]))
+            f.write("       </prefix>\n")
+            if custom_file is not None:
+                f.write("       <custom_file=\"{}\">\n".format(custom_file))
+            f.write("       <commands>\n")
+            for i in range(len(lines)):
+                f.write("           " + ("[" if i == 0 else " ") + lines[i] + ("]" if i == len(lines) - 1 else ",") + "\n")
+            f.write("       </commands>\n")
+            f.write("<end {}>\n".format(title))
+
+
+if __name__ == "__main__":
+    midi_file = sys.argv[1]
+    import_mode = sys.argv[2] if len(sys.argv) > 2 else "cn_mode"
+    import_key = sys.argv[3] if len(sys.argv) > 3 else None
+
+    import_title = midi_file.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    import_settings, import_commands, import_custom = MidiImport.to_commands(midi_file, mode=import_mode,
+                                                                             key=import_key)
+    import_custom_file = None
+    if import_custom:
+        import_custom_file = import_title + "_import.txt"
+        MidiImport.write_custom(import_custom_file, import_custom)
+    MidiImport.write_mwm(import_title + "_import.mwm", import_title, import_settings, import_commands,
+                         custom_file=import_custom_file)
+
+    for error in MidiWrite.diagnostics:
+        print("{} [command: {}]".format(error, error.command))
+    print("Imported {} chords from {} into {}".format(len(import_commands), midi_file, import_title + "_import.mwm"))
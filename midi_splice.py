@@ -0,0 +1,370 @@
+# joins rendered MIDI files without re-rendering them
+#
+# usage: python midi_splice.py [--align] [output file] [part] [part] ...
+#        where a part is a midi file, optionally followed by a bar range: [file]:[first bar]-[last bar]
+# e.g.   python midi_splice.py song.midi intro.midi verse.midi verse.midi outro.midi
+#        python midi_splice.py edit.midi song.midi:1-8 fill.midi song.midi:9-
+#
+# Track n of the output is track n of every part, one after the other. The inputs are memory-mapped and the events of
+# whole files are written out through one memoryview slice per track without being decoded, so joining them runs at
+# disk speed. The writer only steps in at the joints: the delta time of the first event of each part is rewritten, the
+# end of track of every part but the last (always the last three bytes of a track) becomes an empty text event, and the
+# leading tempo, time signature and track name of every part but the first are dropped. Bar ranges and --align are the
+# exception: their events have to be read to find the range or the length of each track, and notes still sounding at
+# the end of a range are turned off. Chunk lengths are patched in once each track has been written.
+
+import mmap
+import re
+import struct
+import sys
+from midi_events import MidiEvents
+from midi_writer import MidiWrite
+
+end_of_track = 0x2f
+end_of_track_event = b'\xff\x2f\x00'
+empty_text_event = b'\xff\x01\x00'  # written in place of the end of track of a part that is followed by another
+dropped_meta = (0x03, 0x51, 0x58)  # track name, tempo and time signature are taken from the first part
+
+part_pattern = re.compile(r'^(.*):(\d*)-(\d*)$')  # [file]:[first bar]-[last bar]
+
+
+class MidiSplice:
+    @staticmethod
+    def open(file: str) -> (mmap.mmap, bytes, [(int, int)]):
+        """
+        Memory-maps a midi file.
+        :param file: the midi file
+        :return: the memory map, the header chunk data and the (offset, length) of every track chunk
+        """
+        chunks = MidiWrite.read_chunks(file)
+        if not chunks or chunks[0][0] != MidiWrite.mthd:
+            raise ValueError("{} is not a midi file".format(file))
+
+        with open(file, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = data[chunks[0][1]:chunks[0][1] + chunks[0][2]]
+        tracks = [(offset, length) for chunk_type, offset, length in chunks if chunk_type == MidiWrite.mtrk]
+
+        return data, header, tracks
+
+    @staticmethod
+    def track_length(data, track: (int, int)) -> int:
+        """
+        Adds up the delta times of a track.
+        :param data: the midi file
+        :param track: the (offset, length) of the track chunk
+        :return: the tick of the last event (the end of track)
+        """
+        pos, stop = track[0], track[0] + track[1]
+        tick, status = 0, 0
+
+        while pos < stop:
+            delta, pos = MidiEvents.read_var_len(data, pos)
+            tick += delta
+
+            kind = data[pos]
+            if kind < 0x80:
+                kind = status
+            else:
+                pos += 1
+                if kind < 0xf0:
+                    status = kind
+
+            meta, pos = MidiEvents.event_end(data, pos, kind)
+            if meta == end_of_track:
+                break
+
+        return tick
+
+    @staticmethod
+    def bar_ticks(data, header: bytes, tracks: [(int, int)]) -> int:
+        """
+        Works out the length of a bar from the first time signature of a file (4/4 if it has none).
+        :param data: the midi file
+        :param header: the header chunk data
+        :param tracks: the track chunks
+        :return: the number of ticks in a bar
+        """
+        ppq = struct.unpack(">H", header[4:6])[0]
+
+        for offset, length in tracks:
+            pos, stop, status = offset, offset + length, 0
+            while pos < stop:
+                _, pos = MidiEvents.read_var_len(data, pos)
+                kind = data[pos]
+                if kind < 0x80:
+                    kind = status
+                else:
+                    pos += 1
+                    if kind < 0xf0:
+                        status = kind
+
+                meta, end = MidiEvents.event_end(data, pos, kind)
+                if meta == 0x58:
+                    body = MidiEvents.read_var_len(data, pos + 1)[1]
+                    return ppq * 4 * data[body] // 2 ** data[body + 1]
+                pos = end
+
+        return ppq * 4
+
+    @staticmethod
+    def copy_whole(f, data, track: (int, int), pending: int, first: bool, last: bool) -> int:
+        """
+        Writes a whole track of a part. Only the meta events at the start of the track are read, everything from the
+        first other event to the end of the chunk is written out in one slice. The end of track has to be the last event
+        of a track, so it is the last three bytes of the chunk; unless the part is the last one, they are replaced by an
+        empty text event, which keeps the delta time in front of them without having to find where it starts.
+        :param f: the output file
+        :param data: the midi file of the part
+        :param track: the (offset, length) of the track chunk
+        :param pending: ticks from the last event written to the output track to the start of the part
+        :param first: whether this is the first part
+        :param last: whether this is the last part (its end of track is copied as well)
+        :return: ticks from the last event written to the end of the part, or None if the end of track was written
+        """
+        pos, stop = track[0], track[0] + track[1]
+        if data[stop - 3:stop] != end_of_track_event:
+            raise ValueError("track at byte {} does not end with an end of track event".format(track[0]))
+
+        while pos < stop:
+            delta, body = MidiEvents.read_var_len(data, pos)
+            if data[body] != 0xff:
+                f.write(MidiEvents.write_var_len(pending + delta))
+                if last:
+                    f.write(memoryview(data)[body:stop])
+                    return None
+                f.write(memoryview(data)[body:stop - 3])
+                f.write(empty_text_event)
+                return 0
+
+            meta, end = MidiEvents.event_end(data, body + 1, 0xff)
+            pending += delta
+            if meta == end_of_track:
+                return pending
+            if first or meta not in dropped_meta:
+                f.write(MidiEvents.write_var_len(pending) + data[body:end])
+                pending = 0
+            pos = end
+
+        raise ValueError("track at byte {} does not end with an end of track event".format(track[0]))
+
+    @staticmethod
+    def copy_range(f, data, track: (int, int), start: int, end: int, pending: int, first: bool) -> int:
+        """
+        Writes the events of one track of a part that is a tick range of a file.
+        Events before the start of the range are played at its start (notes excepted), events from its end on are left
+        out, and notes still sounding at its end are turned off.
+        :param f: the output file
+        :param data: the midi file of the part
+        :param track: the (offset, length) of the track chunk
+        :param start: the first tick of the range
+        :param end: the tick the range ends at (None for the end of the file)
+        :param pending: ticks from the last event written to the output track to the start of the part
+        :param first: whether this is the first part
+        :return: ticks from the last event written to the end of the part
+        """
+        view = memoryview(data)
+        pos, stop = track[0], track[0] + track[1]
+        tick, status = 0, 0
+        written = -pending          # tick of the last event written, counted from the start of the range
+        run_start = run_end = None  # events copied as they are
+        carried = {}                # notes sounding at the start -> note-offs still to leave out
+        started = {}                # notes started in the range -> number still sounding
+
+        while pos < stop:
+            event_start = pos
+            delta, pos = MidiEvents.read_var_len(data, pos)
+            tick += delta
+            if end is not None and tick >= end:
+                break
+
+            body = pos
+            kind = data[pos]
+            running = kind < 0x80
+            if running:
+                kind = status
+            else:
+                pos += 1
+                if kind < 0xf0:
+                    status = kind
+            meta, pos = MidiEvents.event_end(data, pos, kind)
+
+            if meta == end_of_track:
+                if end is None:
+                    end = tick
+                break
+            if not first and meta in dropped_meta:
+                continue
+
+            if kind & 0xf0 in (0x80, 0x90):
+                note = (kind & 0x0f, data[pos - 2])
+                on = kind & 0xf0 == 0x90 and data[pos - 1] > 0
+                if tick < start:
+                    if on:
+                        carried[note] = carried.get(note, 0) + 1
+                    elif carried.get(note):
+                        carried[note] -= 1
+                    continue
+                elif on:
+                    started[note] = started.get(note, 0) + 1
+                elif started.get(note):
+                    started[note] -= 1
+                elif carried.get(note):
+                    carried[note] -= 1
+                    continue
+
+            event_tick = max(tick - start, 0)
+            if run_start is not None and run_end == event_start and event_tick - written == delta:
+                run_end = pos
+            else:
+                if run_start is not None:
+                    f.write(view[run_start:run_end])
+                f.write(MidiEvents.write_var_len(event_tick - written) + (bytes([kind]) if running else b''))
+                run_start, run_end = body, pos
+            written = event_tick
+
+        if run_start is not None:
+            f.write(view[run_start:run_end])
+
+        length = max((end if end is not None else tick) - start, 0)
+        for (channel, note), count in started.items():
+            for _ in range(count):
+                f.write(MidiEvents.write_var_len(length - written) + bytes([0x80 | channel, note, 0]))
+                written = length
+
+        return length - written
+
+    @staticmethod
+    def join(parts: [(str, int, int)], output: str, align=False) -> int:
+        """
+        Writes parts of midi files one after the other into a new file.
+        Each output track is the same track of every part joined end to end, so whole files are copied without decoding
+        their events. A part's tracks only line up with each other if they end at the same tick; align pads them to
+        the end of the part's longest track instead, which means reading every event of the file once.
+        :param parts: the parts as (midi file, first tick, end tick); the end tick is None for the end of the file
+        :param output: the midi file to write to
+        :param align: start each part on all tracks at the same tick
+        :return: the number of bytes written
+        """
+        files = {}  # midi file -> (data, header, tracks)
+        for file, _, _ in parts:
+            if file not in files:
+                files[file] = MidiSplice.open(file)
+
+        division = files[parts[0][0]][1][4:6]
+        for file in files:
+            if files[file][1][4:6] != division:
+                raise ValueError("{} does not have the same ppq as {}".format(file, parts[0][0]))
+
+        lengths = {}  # midi file -> ticks of each track, read when needed
+
+        def track_lengths(file):
+            if file not in lengths:
+                data, _, tracks = files[file]
+                lengths[file] = [MidiSplice.track_length(data, track) for track in tracks]
+            return lengths[file]
+
+        track_count = max(len(files[file][2]) for file in files)
+        fmat = 1 if track_count > 1 else struct.unpack(">H", files[parts[0][0]][1][0:2])[0]
+
+        with open(output, "wb") as f:
+            f.write(MidiWrite.mthd + MidiWrite.header_chunk_length + struct.pack(">HH", fmat, track_count) + division)
+
+            for n in range(track_count):
+                f.write(MidiWrite.mtrk)
+                length_pos = f.tell()
+                f.write(MidiWrite.chunk_length_stub)
+
+                pending = 0
+                for i, (file, start, end) in enumerate(parts):
+                    data, _, tracks = files[file]
+                    whole = start == 0 and end is None
+
+                    if n >= len(tracks):
+                        # the part has no such track, only its length is needed
+                        pending += (max(track_lengths(file) or [0]) if end is None else end) - start
+                    elif whole:
+                        last = i == len(parts) - 1 and not align
+                        pending = MidiSplice.copy_whole(f, data, tracks[n], pending, i == 0, last)
+                        if align:
+                            pending += max(track_lengths(file)) - track_lengths(file)[n]
+                    else:
+                        if align and end is None:
+                            end = max(track_lengths(file))
+                        pending = MidiSplice.copy_range(f, data, tracks[n], start, end, pending, i == 0)
+
+                if pending is not None:
+                    f.write(MidiEvents.write_var_len(pending) + end_of_track_event)
+                MidiWrite.write_chunk_length(f, length_pos)
+
+            size = f.tell()
+
+        for data, _, _ in files.values():
+            data.close()
+
+        return size
+
+    @staticmethod
+    def bar_range(file: str, first: int, last: int) -> (int, int):
+        """
+        Converts a bar range of a midi file to ticks.
+        :param file: the midi file
+        :param first: the first bar, counting from 1
+        :param last: the last bar (None for the end of the file)
+        :return: the first tick and the end tick (None for the end of the file)
+        """
+        data, header, tracks = MidiSplice.open(file)
+        bar = MidiSplice.bar_ticks(data, header, tracks)
+        data.close()
+
+        return (first - 1) * bar, (last * bar if last is not None else None)
+
+    @staticmethod
+    def concatenate(files: [str], output: str):
+        """
+        Joins whole midi files one after the other.
+        :param files: the midi files
+        :param output: the midi file to write to
+        :return: the number of bytes written
+        """
+        return MidiSplice.join([(file, 0, None) for file in files], output)
+
+    @staticmethod
+    def splice(file: str, insert: str, bar: int, output: str):
+        """
+        Inserts a midi file into another one before the given bar.
+        :param file: the midi file to insert into
+        :param insert: the midi file to insert
+        :param bar: the bar to insert before, counting from 1
+        :param output: the midi file to write to
+        :return: the number of bytes written
+        """
+        split = MidiSplice.bar_range(file, bar, None)[0]
+
+        return MidiSplice.join([(file, 0, split), (insert, 0, None), (file, split, None)], output)
+
+    @staticmethod
+    def read_part(part: str) -> (str, int, int):
+        """
+        Reads a part given on the command line, e.g. 'song.midi', 'song.midi:5-8' or 'song.midi:9-'.
+        :param part: the part
+        :return: (midi file, first tick, end tick)
+        """
+        match = part_pattern.match(part)
+        if match is None:
+            return part, 0, None
+
+        file, first, last = match.groups()
+        return (file,) + MidiSplice.bar_range(file, int(first or 1), int(last) if last else None)
+
+
+if __name__ == "__main__":
+    align = "--align" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--align"]
+    if len(args) < 2:
+        print("usage: python midi_splice.py [--align] [output file] [part] [part] ...")
+        exit(1)
+
+    size = MidiSplice.join([MidiSplice.read_part(part) for part in args[1:]], args[0], align=align)
+    print("Joined {} parts into {} ({} bytes)".format(len(args) - 1, args[0], size))
@@ -3,7 +3,7 @@
 # TODO: check support for arpeggio patterns e.g. "4/4:1;[03-1-2-03-1-2]"
 #       for now patterns are dotted eighths
 #       user can point to a custom defined file
-# TODO: add support for single notes, scales and other musical ideas including common progressions
+# TODO: add support for other musical ideas including common progressions
 #       e.g. add support for hammer-ons / pull-offs, and more
 # TODO: improve debug functionality
 #       give more feedback on different areas of the program
@@ -16,10 +16,18 @@
 ##-------------------------------------------------------------------------------------------------------------------##
 
 import array
+import collections
+import itertools
 import struct
 import math
+import multiprocessing
 import re
 from ToneHelper import ToneHelper
+from chord_index import ChordIndex
+from chord_vocabulary import ChordVocabulary
+from errors import ChordError, FlagError, MidiWriteError, NoteError, SectionError
+from midi_events import MidiEvents
+from track_index import TrackIndexer
 
 
 # class for helper functions
@@ -40,30 +48,111 @@ class MidiWrite:
     note_map = ToneHelper.note_map
     ppq = None
     key_signature = None
+    time_signature = "4/4"
 
-    # user defined file that contains additional chord mappings
+    # user defined file that contains additional chord mappings, and its index (see chord_index.py)
     custom_file = None
+    custom_index = None
+
+    # named sections of commands that can be repeated with "@name:count", and their length in chords
+    sections = {}
+    section_lengths = {}
 
     debug = False  # set in track_chunk
 
+    # errors in the commands of the last render; each bad command is written as a placeholder note instead
+    diagnostics = []
+    validated = {}  # (command, mode, key signature, custom file) -> error or None, kept across validate calls; section
+                    # references are left out, they depend on the sections of the file
+
     # constant bytes
     mthd                = b'\x4d\x54\x68\x64'
     header_chunk_length = b'\x00\x00\x00\x06'
 
     mtrk                = b'\x4d\x54\x72\x6b'
-    track_chunk_length  = b'\x00\x00\x00\x14'
+    chunk_length_stub   = b'\x00\x00\x00\x00'  # patched once the chunk has been written
 
     eof                 = b'\x01\xff\x2f\x00'
 
+    # root-string markers in order of the octave they start in, and flags moving a chord up / down an octave
+    root_markers = ["*", "**", "***"]
+    octave_flags = {'-8va': 12, '-8vb': -12}
+
+    # single notes and scale runs, e.g. "-e n:C#4" or "-s n:C4~G5" (every note of the key from C4 up to G5); the "n:"
+    # keeps them apart from chord names such as "G7" or "C9"
+    note_token = re.compile(r'^(-o|-\.?[whqest])?\s*n:([A-G](?:##|#|bb|b)?)(-?\d)(?:~([A-G](?:##|#|bb|b)?)(-?\d))?$')
+    melodies = {}  # encoded note tokens, keyed by token, ppq, key signature and octave shift
+    melody_cache_size = 4096  # tokens kept in melodies; it starts over when full, so it stays bounded across renders
+
+    # root, chord type and root-string marker of a resolved chord name, e.g. "Dbmaj7#11**"
+    chord_name = re.compile(r'^\s*([A-G][#b]?)([^*%\s]*)(\*{1,3})\s*$')
+    root_name = re.compile(r'[A-G][#b]?')  # the first note name in a chord that does not fit chord_name
+
     @staticmethod
     def set_custom_file(file: str):
         """
-        Sets a pointer to the custom file.
-        :param file: the custom file
+        Sets a pointer to the custom file and loads its index.
+        The custom file can either be a text file or an index compiled with chord_index.py, which is memory-mapped.
+        :param file: the custom file (None to stop using one)
+        :return: none
+        """
+        MidiWrite.custom_index = ChordIndex.open(file) if file is not None else None
+        MidiWrite.custom_file = file
+
+    @staticmethod
+    def set_sections(sections: {str: [str]}):
+        """
+        Sets the named sections commands can refer to and works out how many chords each one expands to.
+        :param sections: dictionary of section name -> commands
         :return: none
         """
-        if file is not None:
-            MidiWrite.custom_file = file
+        MidiWrite.sections = sections if sections is not None else {}
+        MidiWrite.section_lengths = {}
+
+        def length(name, visiting):
+            if name in visiting:
+                raise SectionError("section {} repeats itself".format(name))
+            if name not in MidiWrite.section_lengths:
+                total = 0
+                for command in MidiWrite.sections[name]:
+                    ref = MidiWrite.section_ref(command)
+                    total += 1 if ref is None else ref[1] * length(ref[0], visiting + (name,))
+                MidiWrite.section_lengths[name] = total
+            return MidiWrite.section_lengths[name]
+
+        for section in MidiWrite.sections:
+            length(section, ())
+
+    @staticmethod
+    def section_ref(command) -> (str, int):
+        """
+        Reads a reference to a section, e.g. "@verse:4" (play the verse four times) or "@chorus" (once).
+        References to sections that are not defined are not read as references: they end up in MidiWrite.resolve, which
+        reports them, and are played as a placeholder note.
+        :param command: the command
+        :return: the section name and repeat count, or None if the command is not a section reference
+        """
+        if not isinstance(command, str) or not command.startswith("@"):
+            return None
+
+        name, _, count = command[1:].partition(":")
+        if name not in MidiWrite.sections or (count and not count.isdigit()):
+            return None
+        return name, int(count) if count else 1
+
+    @staticmethod
+    def command_length(command) -> int:
+        """
+        Counts the chords a command expands to.
+        :param command: the command
+        :return: 1 for a chord, the length of the section times the repeat count for a section reference
+        """
+        ref = MidiWrite.section_ref(command)
+        if ref is None:
+            return 1
+        if ref[0] not in MidiWrite.section_lengths:
+            raise SectionError("section {} is not defined".format(ref[0]), command)
+        return ref[1] * MidiWrite.section_lengths[ref[0]]
 
     @staticmethod
     def octave_shift_down(n: int):
@@ -126,7 +215,7 @@ class MidiWrite:
                 print("Original: {}, sending byte {}: {}".format(original, i+1, hex(byte_arr[i])))
             print("Done sending.\n")
 
-        byte_arr = array.array('B', byte_arr).tostring()
+        byte_arr = array.array('B', byte_arr).tobytes()
         return byte_arr
 
     @staticmethod
@@ -136,14 +225,7 @@ class MidiWrite:
         :param n: the variable-length quantity to convert
         :return: integer representation of the variable-length quantity
         """
-        i = 0
-        c = n[i]
-        q = c & 0x7f
-
-        while c & 0x80:
-            i += 1
-            c = n[i]
-            q = (q << 7) | (c & 0x7f)
+        q = MidiEvents.read_var_len(n, 0)[0]
 
         if len(n) > 0 and q == 0:
             q = n[1]
@@ -166,6 +248,7 @@ class MidiWrite:
             exit(1)
 
         MidiWrite.ppq = MidiWrite.write_var_len(ppq)
+        MidiWrite.time_signature = time
 
         MidiWrite.write_header_chunk(file)
         MidiWrite.write_track_chunk(file, time, tempo)
@@ -200,10 +283,14 @@ class MidiWrite:
 
         with open(file, "ab") as f:
             f.write(MidiWrite.mtrk)
-            f.write(MidiWrite.track_chunk_length)
+            length_pos = f.tell()
+            f.write(MidiWrite.chunk_length_stub)
 
         MidiWrite.write_time_sig(file, time, tempo)
 
+        with open(file, "r+b") as f:
+            MidiWrite.write_chunk_length(f, length_pos)
+
     @staticmethod
     def write_time_sig(file: str, time: str, tempo: int):
         """
@@ -220,13 +307,7 @@ class MidiWrite:
         time_sig_end_bytes = b'\x24\x08'
 
         # to convert bpm to tempo, use 60_000_000 / tempo
-        tempo_hex = hex(int(60_000_000 / tempo))  # number of microseconds in a minute
-
-        if len(tempo_hex) % 2 == 1:
-            byte_1 = int(tempo_hex[:2] + '0' + tempo_hex[2], 0)
-            byte_2 = int(tempo_hex[:2] + tempo_hex[3:5], 0)
-            byte_3 = int(tempo_hex[:2] + tempo_hex[5:], 0)
-            tempo_bytes += struct.pack("BBB", byte_1, byte_2, byte_3)
+        tempo_bytes += struct.pack(">I", int(60_000_000 / tempo))[1:]  # number of microseconds in a minute, 24-bit
 
         ts_num = bytes([int(time.split("/")[0])])
         ts_denom = bytes([int(math.log(int(time.split("/")[1]), 2))])
@@ -239,7 +320,103 @@ class MidiWrite:
             f.write(eot)
 
     @staticmethod
-    def write_track(file: str, commands: [bytes], title='Main', key='Cmaj', mode="cn_mode", shift=0, debug=False, arpeggiate=False):
+    def write_chunk_length(f, length_pos: int):
+        """
+        Patches the 32-bit big-endian length of a chunk once all of its data has been written.
+        :param f: the midi file opened for binary writing
+        :param length_pos: the file offset of the chunk's length field
+        :return: the length of the chunk data
+        """
+        f.seek(0, 2)
+        end = f.tell()
+        length = end - (length_pos + len(MidiWrite.chunk_length_stub))
+
+        f.seek(length_pos)
+        f.write(struct.pack(">I", length))
+        f.seek(end)
+
+        return length
+
+    @staticmethod
+    def read_chunks(file: str) -> [(bytes, int, int)]:
+        """
+        Reads back the chunk layout of a midi file.
+        :param file: the midi file to read
+        :return: list of (chunk type, data offset, data length) for every chunk in the file
+        """
+        chunks = []
+
+        with open(file, "rb") as f:
+            f.seek(0, 2)
+            size = f.tell()
+            offset = 0
+
+            while offset < size:
+                f.seek(offset)
+                chunk_header = f.read(8)
+                if len(chunk_header) < 8:
+                    raise ValueError("truncated chunk header at byte {}".format(offset))
+
+                chunk_type, length = chunk_header[:4], struct.unpack(">I", chunk_header[4:])[0]
+                if offset + 8 + length > size:
+                    raise ValueError("chunk {} at byte {} runs past end of file".format(chunk_type, offset))
+
+                chunks.append((chunk_type, offset + 8, length))
+                offset += 8 + length
+
+        return chunks
+
+    @staticmethod
+    def prepare_track(commands: [str], key='Cmaj', mode="cn_mode", shift=0, arpeggiate=False, auto_voice=False,
+                      sections=None, bars=None, command_range=None, index=False) -> ([str], bool, TrackIndexer):
+        """
+        Applies the settings of a track before its commands are encoded (shared by write_track and Pipeline).
+        :param commands: the commands of the track
+        :param key: the key signature of the track
+        :param mode: the type of chords entered
+        :param shift: octave shift up / down
+        :param arpeggiate: arpeggiate every chord
+        :param auto_voice: pick root strings / octaves for chords without markers (reads all the commands first)
+        :param sections: named sections of commands, repeated in commands with "@name:count"
+        :param bars: only write the chords starting in these bars, (first, last) counting from 1
+        :param command_range: only write these commands, (first, last) counting from 1
+        :param index: also write a sidecar index of the bars and commands of the track ([file].mwti)
+        :return: the commands to encode, the arpeggio flip state at the first of them and the TrackIndexer of the track
+                 (None without an index)
+        :raises ChordError: if the key signature is unknown
+        """
+        ToneHelper.get_key(key)
+        MidiWrite.key_signature = key
+        MidiWrite.diagnostics = []
+
+        if shift is None:
+            shift = 0
+
+        if shift != 0:
+            if shift < 0:
+                MidiWrite.octave_shift_down(abs(shift))
+            else:
+                MidiWrite.octave_shift_up(shift)
+
+        if auto_voice:
+            commands = MidiWrite.auto_voice(list(commands), mode=mode)
+            if sections is not None:
+                sections = {name: MidiWrite.auto_voice(section, mode=mode) for name, section in sections.items()}
+
+        MidiWrite.set_sections(sections)
+
+        flip = False
+        if bars is not None or command_range is not None:
+            commands, flip = MidiWrite.select_range(commands, mode=mode, arpeggiate=arpeggiate, bars=bars,
+                                                    command_range=command_range)
+
+        indexer = TrackIndexer(MidiWrite.read_var_len(MidiWrite.ppq), MidiWrite.time_signature) if index else None
+
+        return commands, flip, indexer
+
+    @staticmethod
+    def write_track(file: str, commands: [bytes], title='Main', key='Cmaj', mode="cn_mode", shift=0, debug=False, arpeggiate=False,
+                    auto_voice=False, workers=1, sections=None, bars=None, command_range=None, index=False):
         """
                Writes the track data to the midi file.
                :param file: the midi file to write to
@@ -250,23 +427,294 @@ class MidiWrite:
                :param shift: octave shift up / down
                :param debug: show progress on creating midi file
                :param arpeggiate: arpeggiate every chord
-               :return: none
+               :param auto_voice: pick root strings / octaves for chords without markers
+               :param workers: number of processes encoding segments of the track in parallel
+               :param sections: named sections of commands, repeated in commands with "@name:count"
+               :param bars: only write the chords starting in these bars, (first, last) counting from 1
+               :param command_range: only write these commands, (first, last) counting from 1
+               :param index: also write a sidecar index of the bars and commands of the track ([file].mwti)
+               :return: the errors found in the commands (see MidiWrite.diagnostics)
+               :raises ChordError: if the key signature is unknown, before anything is written
+        """
+        if debug:
+            MidiWrite.debug = True
+
+        commands, flip, indexer = MidiWrite.prepare_track(commands, key=key, mode=mode, shift=shift,
+                                                          arpeggiate=arpeggiate, auto_voice=auto_voice,
+                                                          sections=sections, bars=bars, command_range=command_range,
+                                                          index=index)
+
+        if workers is not None and workers > 1 and not MidiWrite.debug:
+            encoded = MidiWrite.encode_parallel(commands, mode=mode, arpeggiate=arpeggiate, workers=workers, flip=flip,
+                                                index=indexer)
+        elif indexer is not None:
+            encoded = MidiWrite.encode_indexed(commands, indexer, mode=mode, arpeggiate=arpeggiate, file=file,
+                                               flip=flip)
+        else:
+            encoded = MidiWrite.encode_commands(commands, mode=mode, arpeggiate=arpeggiate, file=file, flip=flip)
+
+        MidiWrite.write_encoded_track(file, encoded, title=title, key=key, index=indexer)
+
+        return MidiWrite.diagnostics
+
+    @staticmethod
+    def encode_commands(commands: [str], mode="cn_mode", arpeggiate=False, file=None, flip=False, cache=None):
+        """
+        Encodes commands one after the other.
+        Sections are encoded once for each arpeggio flip state they start in; repeats reuse the encoded bytes.
+        :param commands: the commands to encode
+        :param mode: the type of chords entered
+        :param arpeggiate: arpeggiate every chord
+        :param file: the midi file being written (for debug output)
+        :param flip: the arpeggio flip state at the first command
+        :param cache: encoded sections, keyed by (name, flip state)
+        :return: generator of the encoded events of each command
+        """
+        if cache is None:
+            cache = {}
+
+        for chord in commands:
+            ref = MidiWrite.section_ref(chord)
+            if ref is not None:
+                name, count = ref
+                for _ in range(count):
+                    if (name, flip) not in cache:
+                        cache[(name, flip)] = b''.join(MidiWrite.encode_commands(
+                            MidiWrite.sections[name], mode=mode, arpeggiate=arpeggiate, file=file, flip=flip,
+                            cache=cache))
+                    yield cache[(name, flip)]
+                    if arpeggiate and MidiWrite.section_lengths[name] % 2 == 1:
+                        flip = not flip
+                continue
+
+            if arpeggiate:
+                notes = MidiWrite.find_notes(chord, flip=flip, mode=mode)
+                flip = not flip
+            else:
+                notes = MidiWrite.find_notes(chord, mode=mode)
+
+            if MidiWrite.debug:
+                statement = "Write {} to {}".format(chord, file)
+                print(statement)
+                print("=" * len(statement))
+                print("Writing \"{}\" to {}... ".format(chord, file), end="")
+            yield b''.join(notes)
+            if MidiWrite.debug:
+                print("Done.\n")
+
+    @staticmethod
+    def encode_indexed(commands: [str], index, mode="cn_mode", arpeggiate=False, file=None, flip=False):
+        """
+        Encodes commands one after the other like encode_commands, marking where each one starts in a track index.
+        :param commands: the commands to encode
+        :param index: the TrackIndexer of the track
+        :param mode: the type of chords entered
+        :param arpeggiate: arpeggiate every chord
+        :param file: the midi file being written (for debug output)
+        :param flip: the arpeggio flip state at the first command
+        :return: generator of the encoded events of each command
+        """
+        cache = {}
+
+        for command in commands:
+            index.command()
+            yield from MidiWrite.encode_commands([command], mode=mode, arpeggiate=arpeggiate, file=file, flip=flip,
+                                                 cache=cache)
+            if arpeggiate and MidiWrite.command_length(command) % 2 == 1:
+                flip = not flip
+
+    @staticmethod
+    def validate(commands: [str], mode="cn_mode", key="Cmaj", sections=None) -> [MidiWriteError]:
+        """
+        Checks that every command can be played without encoding anything.
+        Each distinct command is only checked once, also across calls, so a whole corpus of files is checked quickly.
+        :param commands: the commands
+        :param mode: the type of chords entered
+        :param key: the key signature
+        :param sections: named sections of commands
+        :return: the errors found, one per distinct bad command
         """
         MidiWrite.key_signature = key
+        try:
+            MidiWrite.set_sections(sections)
+        except MidiWriteError as error:
+            return [error]
 
-        if shift is None:
-            shift = 0
+        errors = []
+        seen = set()
+        for command in itertools.chain(commands, *MidiWrite.sections.values()):
+            if isinstance(command, str):
+                if command in seen:
+                    continue
+                seen.add(command)
 
-        if shift != 0:
-            if shift < 0:
-                MidiWrite.octave_shift_down(abs(shift))
+            error = MidiWrite.check_command(command, mode=mode)
+            if error is not None:
+                errors.append(error)
+
+        return errors
+
+    @staticmethod
+    def check_command(command, mode="cn_mode") -> MidiWriteError:
+        """
+        Checks that a command can be played, remembering the outcome for commands in the same mode, key and custom file.
+        Section references are not remembered, as the sections they point to change from one file to the next.
+        :param command: the command
+        :param mode: the type of chords entered
+        :return: the error found, or None
+        """
+        cache_key = (command, mode, MidiWrite.key_signature, MidiWrite.custom_file)
+        cached = isinstance(command, str) and not command.startswith("@")
+        if cached and cache_key in MidiWrite.validated:
+            return MidiWrite.validated[cache_key]
+
+        error = None
+        try:
+            if MidiWrite.section_ref(command) is not None:
+                MidiWrite.command_length(command)
+            elif MidiWrite.melody_notes(command) is not None:
+                MidiWrite.check_notes(MidiWrite.melody_notes(command)[1], command)
             else:
-                MidiWrite.octave_shift_up(shift)
+                MidiWrite.resolve(command, mode=mode)
+        except MidiWriteError as e:
+            error = e
+            if error.command is None:
+                error.command = command
 
-        if debug:
-            MidiWrite.debug = True
+        if cached:
+            MidiWrite.validated[cache_key] = error
+        return error
+
+    @staticmethod
+    def bar_ticks() -> int:
+        """
+        Works out the length of a bar from the time signature and ppq set by write_preqs.
+        :return: the number of ticks in a bar
+        """
+        numerator, denominator = [int(n) for n in MidiWrite.time_signature.split("/")]
+
+        return MidiWrite.read_var_len(MidiWrite.ppq) * 4 * numerator // denominator
+
+    @staticmethod
+    def command_ticks(chord, mode="cn_mode") -> int:
+        """
+        Works out how many ticks a chord takes up without encoding it.
+        Only arpeggiated chords have to be resolved, as their length depends on the number of notes.
+        :param chord: the chord
+        :param mode: the type of chords entered
+        :return: the length of the chord in ticks
+        """
+        try:
+            melody = MidiWrite.melody_notes(chord)
+            if melody is not None:
+                MidiWrite.check_notes(melody[1], chord)
+                return len(melody[1]) * MidiWrite.read_var_len(MidiWrite.note_delays(melody[0])[0])
+
+            search_chord, arpeggiate, arp_rev, note_type, pattern, octave = MidiWrite.chord_flags(chord)
+            delay, time_arp_delay = MidiWrite.note_delays(note_type, pattern)
+            if arpeggiate:
+                notes = MidiWrite.resolve(chord, mode=mode)[0]
+        except MidiWriteError:
+            return sum(MidiWrite.read_var_len(events[:2]) for events in MidiWrite.placeholder())
 
-        chunk_length = b'\x00\x00'  # TODO: what is this used for?
+        if arpeggiate:
+            return min(len(notes), 4) * MidiWrite.read_var_len(time_arp_delay)
+        elif pattern is not None:
+            return len(pattern.split("-")) * MidiWrite.read_var_len(delay)
+
+        return MidiWrite.read_var_len(delay)
+
+    @staticmethod
+    def select_range(commands: [str], mode="cn_mode", arpeggiate=False, bars=None, command_range=None) -> ([str], bool):
+        """
+        Picks out the commands of a bar or command range, so part of a long progression can be previewed.
+        Nothing before the range is encoded: chords only have their length worked out, whole repeats of sections are
+        skipped at once, and commands after the range are never read.
+        Tempo and key are set for the whole track, so the arpeggio flip state is the only state carried over.
+        :param commands: the commands
+        :param mode: the type of chords entered
+        :param arpeggiate: arpeggiate every chord
+        :param bars: the chords starting in these bars, (first, last) counting from 1
+        :param command_range: these commands, (first, last) counting from 1 (sections count as one command)
+        :return: the commands in the range and the arpeggio flip state at the first of them
+        """
+        selected = []
+        chords = 0  # chords before the range
+
+        if command_range is not None:
+            first, last = command_range
+            for i, command in enumerate(commands, 1):
+                if i > last:
+                    break
+                if i < first:
+                    chords += MidiWrite.command_length(command)
+                else:
+                    selected.append(command)
+
+            return selected, arpeggiate and chords % 2 == 1
+
+        bar = MidiWrite.bar_ticks()
+        start, end = (bars[0] - 1) * bar, bars[1] * bar
+        tick = 0
+        lengths = {}  # command -> ticks, long progressions reuse the same chords
+        section_ticks = {}
+
+        def ticks(command):
+            ref = MidiWrite.section_ref(command)
+            if ref is not None:
+                name, count = ref
+                if name not in section_ticks:
+                    section_ticks[name] = sum(ticks(c) for c in MidiWrite.sections[name])
+                return count * section_ticks[name]
+            if command not in lengths:
+                lengths[command] = MidiWrite.command_ticks(command, mode=mode)
+            return lengths[command]
+
+        def walk(commands):
+            nonlocal tick, chords
+            for command in commands:
+                if tick >= end:
+                    return True
+
+                ref = MidiWrite.section_ref(command)
+                if ref is None:
+                    if tick >= start:
+                        selected.append(command)
+                    else:
+                        chords += 1
+                    tick += ticks(command)
+                    continue
+
+                name, count = ref
+                length = ticks("@" + name)
+                for _ in range(count):
+                    if tick >= end:
+                        return True
+                    if tick + length <= start:
+                        chords += MidiWrite.section_lengths[name]
+                        tick += length
+                    elif tick >= start and tick + length <= end:
+                        selected.append("@" + name)
+                        tick += length
+                    elif walk(MidiWrite.sections[name]):
+                        return True
+            return False
+
+        walk(commands)
+
+        return selected, arpeggiate and chords % 2 == 1
+
+    @staticmethod
+    def write_encoded_track(file: str, encoded, title='Main', key='Cmaj', index=None):
+        """
+        Writes a track chunk around already encoded events.
+        :param file: the midi file to write to
+        :param encoded: iterable of encoded events (bytes)
+        :param title: the title of the track
+        :param key: the key signature of the track
+        :param index: TrackIndexer following the events as they are written, saved next to the file afterwards
+        :return: none
+        """
         preset = b'\x00\xc1' + bytes([24])  # guitar
         chunk_title = b'\x00\xff\x03'
         key_sig = b'\x00\xff\x59\x02'
@@ -278,69 +726,148 @@ class MidiWrite:
 
         flats, major_minor = ToneHelper.get_key(key)
 
-        key_sig += bytes([flats if flats > 0 else 256 + flats])  # two's complement if negative
+        key_sig += bytes([flats if flats >= 0 else 256 + flats])  # two's complement if negative
         key_sig += bytes([major_minor])
 
-        # not sure why count is 1 less than it needs to be
-        count = 1 + len(chunk_length) + len(chunk_title) + len(key_sig) + len(preset) + len(MidiWrite.eof)
-        notes_list = []
-
-        flip = False
-        for chord in commands:
-            if arpeggiate:
-                notes = MidiWrite.find_notes(chord, flip=flip, mode=mode)
-            else:
-                notes = MidiWrite.find_notes(chord, mode=mode)
-            for note in notes:
-                count += len(note)
-            notes_list.append(notes)
-            if arpeggiate:
-                flip = not flip
-
-        b = MidiWrite.write_var_len(count)
-        chunk_length += b
-
-        # just a check to make sure number is formatted correctly
-        if len(chunk_length) < 4:
-            chunk_length = chunk_length[0:2] + b'\x00' + chunk_length[2:]
-
+        # events are streamed straight to the file and the 32-bit chunk length is patched in afterwards,
+        # so tracks are not limited in size and never have to be held in memory
         with open(file, "ab") as f:
             f.write(MidiWrite.mtrk)
-            f.write(chunk_length)
+            length_pos = f.tell()
+            f.write(MidiWrite.chunk_length_stub)
             f.write(chunk_title)
             f.write(key_sig)
             f.write(preset)
 
-            for i in range(len(notes_list)):
-                if MidiWrite.debug:
-                    statement = "Write {} to {}".format(commands[i], file)
-                    print(statement)
-                    print("=" * len(statement))
-                    print("Writing \"{}\" to {}... ".format(commands[i], file), end="")
-                for note in notes_list[i]:
-                    f.write(note)
-                if MidiWrite.debug:
-                    print("Done.\n")
+            if index is None:
+                for events in encoded:
+                    f.write(events)
+            else:
+                index.start(length_pos + len(MidiWrite.chunk_length_stub), len(chunk_title + key_sig + preset))
+                for events in encoded:
+                    index.add(events)
+                    f.write(events)
 
             f.write(MidiWrite.eof)
 
+        with open(file, "r+b") as f:
+            MidiWrite.write_chunk_length(f, length_pos)
+
+        if index is not None:
+            index.write(file)
+
     @staticmethod
-    def find_notes(chord, flip=False, mode="cn_mode") -> [bytes]:
+    def render_state() -> dict:
         """
-        find the notes needed to play the chord
-        :param chord: the chord to find the notes of
-        :return: the midi representation of the chord / notes
+        Collects the class-level settings the encoder depends on, so they can be handed to worker processes.
+        :return: the settings
         """
-        start_simul       = b'\x00\x90'
-        note_on           = b'\x40'
-        note_off          = b'\x00'
-        delay             = MidiWrite.write_var_len(MidiWrite.read_var_len(MidiWrite.ppq) * 2)  # half note default
-        time_arp_delay    = bytes([MidiWrite.ppq[1] // 2])  # 1/2 of b'\x60', the quarter note length
+        return dict(ppq=MidiWrite.ppq, key_signature=MidiWrite.key_signature, custom_file=MidiWrite.custom_file,
+                    note_map=dict(MidiWrite.note_map), sections=MidiWrite.sections)
 
-        notes, arpeggiate, arp_rev, note_type, pattern = MidiWrite.chord_shape(chord, mode=mode)
+    @staticmethod
+    def load_render_state(state: dict):
+        """
+        Restores settings collected by render_state (used to initialise worker processes).
+        :param state: the settings
+        :return: none
+        """
+        MidiWrite.ppq = state["ppq"]
+        MidiWrite.key_signature = state["key_signature"]
+        MidiWrite.set_custom_file(state["custom_file"])
+        MidiWrite.note_map.update(state["note_map"])
+        MidiWrite.set_sections(state["sections"])
 
-        if arp_rev:
-            flip = not flip
+    @staticmethod
+    def encode_segment(segment: ([str], bool, str, bool, bool)) -> (bytes, [int], [MidiWriteError]):
+        """
+        Encodes a run of consecutive commands.
+        :param segment: the commands, the arpeggio flip state at the first command, the mode, whether to arpeggiate and
+                        whether to keep track of where each command ends
+        :return: the encoded events of the commands, the offset each command ends at (None unless asked for) and the
+                 errors found in them
+        """
+        commands, flip, mode, arpeggiate, split = segment
+        MidiWrite.diagnostics = []
+
+        if not split:
+            return b''.join(MidiWrite.encode_commands(commands, mode=mode, arpeggiate=arpeggiate, flip=flip)), None, \
+                MidiWrite.diagnostics
+
+        encoded = bytearray()
+        ends = []
+        cache = {}
+        for command in commands:
+            for events in MidiWrite.encode_commands([command], mode=mode, arpeggiate=arpeggiate, flip=flip,
+                                                    cache=cache):
+                encoded += events
+            ends.append(len(encoded))
+            if arpeggiate and MidiWrite.command_length(command) % 2 == 1:
+                flip = not flip
+
+        return bytes(encoded), ends, MidiWrite.diagnostics
+
+    @staticmethod
+    def encode_parallel(commands: [str], mode="cn_mode", arpeggiate=False, workers=None, segment_length=4096,
+                        flip=False, index=None):
+        """
+        Encodes commands in segments on several processes and yields the encoded segments in order.
+        Every chord only depends on itself, the shared settings and the arpeggio flip state, which alternates with
+        each chord when arpeggiating, so the flip state at the start of each segment is known up front.
+        Only two segments per worker are handed out at a time, so memory stays bounded however long the track is.
+        :param commands: the commands to encode
+        :param mode: the type of chords entered
+        :param arpeggiate: arpeggiate every chord
+        :param workers: number of processes (defaults to the number of cores)
+        :param segment_length: number of commands per segment
+        :param flip: the arpeggio flip state at the first command
+        :param index: TrackIndexer to mark the start of each command in (segments are then yielded command by command)
+        :return: generator of encoded segments, byte-identical to encoding the commands one after the other
+        """
+        commands = list(commands)
+        in_flight = 2 * (workers or multiprocessing.cpu_count())
+
+        def segments():
+            # flip state at the start of each segment: parity of the number of chords before it (sections count as
+            # many chords as they expand to)
+            chords = 0
+            for i in range(0, len(commands), segment_length):
+                segment = commands[i:i + segment_length]
+                yield segment, arpeggiate and (chords % 2 == 1) != flip, mode, arpeggiate, index is not None
+                chords += sum(MidiWrite.command_length(command) for command in segment)
+
+        def collect(result):
+            encoded, ends, diagnostics = result.get()
+            MidiWrite.diagnostics.extend(diagnostics)
+            if index is None:
+                yield encoded
+                return
+            start = 0
+            for end in ends:
+                index.command()
+                yield encoded[start:end]
+                start = end
+
+        with multiprocessing.Pool(workers, initializer=MidiWrite.load_render_state,
+                                  initargs=(MidiWrite.render_state(),)) as pool:
+            pending = collections.deque()
+            for segment in segments():
+                pending.append(pool.apply_async(MidiWrite.encode_segment, (segment,)))
+                if len(pending) >= in_flight:
+                    yield from collect(pending.popleft())
+            while pending:
+                yield from collect(pending.popleft())
+
+    @staticmethod
+    def note_delays(note_type: str, pattern=None) -> (bytes, bytes):
+        """
+        Finds the delta times used for a chord of a given length.
+        :param note_type: the time flag of the chord without its dash ('d' for the default)
+        :param pattern: the arpeggio pattern of the chord, if any
+        :return: the delay before the chord's notes are turned off, and the delay between arpeggiated notes
+        """
+        delay             = MidiWrite.write_var_len(MidiWrite.read_var_len(MidiWrite.ppq) * 2)  # half note default
+        time_arp_delay    = bytes([MidiWrite.ppq[1] // 2])  # 1/2 of b'\x60', the quarter note length
 
         # TODO: test all delays and finish patterns
         if note_type == 'o':
@@ -402,6 +929,180 @@ class MidiWrite:
             delay = bytes([MidiWrite.ppq[1] // 8])
             time_arp_delay = bytes([MidiWrite.ppq[1] // 16])
 
+        return delay, time_arp_delay
+
+    @staticmethod
+    def find_notes(chord, flip=False, mode="cn_mode") -> [bytes]:
+        """
+        find the notes needed to play the chord
+        :param chord: the chord to find the notes of
+        :return: the midi representation of the chord / notes
+        """
+        try:
+            melody = MidiWrite.encode_melody(chord)
+            if melody is not None:
+                return [melody]
+
+            notes, arpeggiate, arp_rev, note_type, pattern = MidiWrite.resolve(chord, mode=mode)
+        except MidiWriteError as error:
+            MidiWrite.report(error, chord)
+            return MidiWrite.placeholder()
+
+        return MidiWrite.encode_notes(notes, arpeggiate, arp_rev, note_type, pattern, flip=flip)
+
+    @staticmethod
+    def resolve(chord, mode="cn_mode") -> ([int], bool, bool, str, str):
+        """
+        Resolves a chord with chord_shape, turning anything that stops it from being played into a MidiWriteError.
+        :param chord: the chord
+        :param mode: the type of chords entered
+        :return: the notes, whether the chord is arpeggiated, whether the arpeggio is reversed, the note type and the
+                 pattern
+        """
+        if isinstance(chord, str) and chord.startswith("@"):
+            raise SectionError("{} does not refer to a defined section".format(chord), chord)
+
+        try:
+            shape = MidiWrite.chord_shape(chord, mode=mode)
+        except MidiWriteError:
+            raise
+        except (LookupError, ValueError) as error:
+            raise ChordError("Chord {} could not be read ({}).".format(chord, error), chord) from error
+
+        if not shape[0]:
+            raise ChordError("Chord {} has no notes.".format(chord), chord)
+        MidiWrite.check_notes(shape[0], chord)
+
+        return shape
+
+    @staticmethod
+    def check_notes(notes: [int], command):
+        """
+        Makes sure notes can be written to a midi file.
+        :param notes: the notes
+        :param command: the command they were read from
+        :return: none
+        """
+        for note in notes:
+            if not 0 <= note <= 127:
+                raise NoteError("note {} of {} is outside of the midi range".format(note, command), command)
+
+    @staticmethod
+    def report(error: MidiWriteError, command):
+        """
+        Records an error in the diagnostics of the render.
+        :param error: the error
+        :param command: the command it was found in
+        :return: none
+        """
+        if error.command is None:
+            error.command = command
+        MidiWrite.diagnostics.append(error)
+
+        if MidiWrite.debug:
+            print("Error in [{}]: {}\n".format(command, error))
+
+    @staticmethod
+    def placeholder() -> [bytes]:
+        """
+        Encodes the note written in place of a command that could not be read.
+        :return: the midi representation of the note
+        """
+        failed_note = 'C'
+        return [b'\x81\x40\x90' + bytes([ToneHelper.note_map[failed_note]]) + b'\x20',
+                b'\x81\x40' + bytes([ToneHelper.note_map[failed_note]]) + b'\x00']
+
+    @staticmethod
+    def note_number(name: str, octave: int) -> int:
+        """
+        Converts a note name and octave to a midi note (C4 is 60), following octave shifts of the note map.
+        :param name: the note name, e.g. 'C#' or 'Bb'
+        :param octave: the octave
+        :return: the midi note
+        """
+        # the note map holds octave 2
+        return MidiWrite.note_map[name[0]] + name.count("#") - name.count("b") + 12 * (octave - 2)
+
+    @staticmethod
+    def melody_notes(command) -> (str, [int]):
+        """
+        Reads a single note ("-q n:C#4") or a scale run ("-s n:C4~G5", every note of the key signature's scale from the
+        first note to the second, up or down).
+        :param command: the command
+        :return: the note type and the notes, or None if the command is not a note token
+        """
+        match = MidiWrite.note_token.match(command) if isinstance(command, str) else None
+        if match is None:
+            return None
+
+        flag, name, octave, end_name, end_octave = match.groups()
+        note_type = flag[1:] if flag else 'd'
+        start = MidiWrite.note_number(name, int(octave))
+        if end_name is None:
+            return note_type, [start]
+
+        end = MidiWrite.note_number(end_name, int(end_octave))
+        scale = ToneHelper.scale_pitch_classes(MidiWrite.key_signature)
+        step = 1 if end >= start else -1
+
+        return note_type, [n for n in range(start, end + step, step) if n % 12 in scale or n == start or n == end]
+
+    @staticmethod
+    def encode_melody(command) -> bytes:
+        """
+        Encodes a single note or scale run without going through chord_shape.
+        :param command: the command
+        :return: the midi representation of the notes, or None if the command is not a note token
+        """
+        if not isinstance(command, str):
+            return None
+
+        key = (command, MidiWrite.ppq, MidiWrite.key_signature, MidiWrite.note_map["C"])
+        if key in MidiWrite.melodies:
+            return MidiWrite.melodies[key]
+
+        melody = MidiWrite.melody_notes(command)
+        if melody is None:
+            return None
+
+        note_type, notes = melody
+        delay = MidiWrite.note_delays(note_type)[0]
+        events = bytearray()
+        MidiWrite.check_notes(notes, command)
+        for note in notes:
+            events += b'\x00\x90'
+            events.append(note)
+            events += b'\x40'
+            events += delay
+            events.append(note)
+            events.append(0)
+
+        if len(MidiWrite.melodies) >= MidiWrite.melody_cache_size:
+            MidiWrite.melodies.clear()
+        MidiWrite.melodies[key] = bytes(events)
+        return MidiWrite.melodies[key]
+
+    @staticmethod
+    def encode_notes(notes: [int], arpeggiate=False, arp_rev=False, note_type='d', pattern=None, flip=False) -> [bytes]:
+        """
+        Encodes a chord that has already been resolved by chord_shape.
+        :param notes: the notes of the chord
+        :param arpeggiate: arpeggiate the chord
+        :param arp_rev: reverse the arpeggio
+        :param note_type: the time flag of the chord without its dash ('d' for the default)
+        :param pattern: the arpeggio pattern of the chord, if any
+        :param flip: the arpeggio flip state
+        :return: the midi representation of the chord / notes
+        """
+        start_simul       = b'\x00\x90'
+        note_on           = b'\x40'
+        note_off          = b'\x00'
+
+        if arp_rev:
+            flip = not flip
+
+        delay, time_arp_delay = MidiWrite.note_delays(note_type, pattern)
+
         note_arr = []
 
         if notes:
@@ -463,17 +1164,15 @@ class MidiWrite:
 
             return note_arr
         else:
-            failed_note = 'C'
-            return [b'\x81\x40\x90' + bytes([ToneHelper.note_map[failed_note]]) + b'\x20',
-                    b'\x81\x40' + bytes([ToneHelper.note_map[failed_note]]) + b'\x00']  # return single failed note
+            return MidiWrite.placeholder()  # return single failed note
 
     @staticmethod
-    def chord_shape(chord, mode="cn_mode") -> [int]:
+    def chord_flags(chord) -> (str, bool, bool, str, str, int):
         """
-        determine the notes of the chord based on chord type / fret locations
-        :param chord: the chord to find the notes of
-        :param mode: the type of chords entered (normal / roman numeral)
-        :return: the chord as a set of integer notes
+        Strips the pattern, arpeggio, time and octave flags off a chord.
+        :param chord: the chord
+        :return: the rest of the chord, whether it is arpeggiated, whether the arpeggio is reversed, the note type,
+                 the pattern and the octave offset
         """
         arpeggiate = False
         pattern = None
@@ -481,6 +1180,7 @@ class MidiWrite:
         found_flags = False
         search_chord = chord
         note_type = 'd'
+        octave = 0
         
         if isinstance(chord, str):
             # TODO: make sure pattern time sig matches given time sig
@@ -488,21 +1188,17 @@ class MidiWrite:
             for pat in ToneHelper.patterns:
                 if pat in chord:
                     pattern = ToneHelper.patterns[pat]
-                    if pattern is None and MidiWrite.custom_file is not None:
-                        if MidiWrite.debug:
-                            print("Pattern not found in default, searching {}...".format(MidiWrite.custom_file))
-                        with open(MidiWrite.custom_file, 'r') as f:
-                            custom_pattern_dict = {}
-                            for line in f:
-                                line = line.split(";")
-                                if len(line) > 1:
-                                    custom_pattern_dict[line[0]] = line[1]  # is a str?
-                            for c_pat in custom_pattern_dict:
-                                if c_pat in chord:
-                                    pattern = custom_pattern_dict[c_pat]
-                    else:
-                        if MidiWrite.debug:
-                            print("pattern found: {}".format(pattern))
+                    if MidiWrite.debug:
+                        print("pattern found: {}".format(pattern))
+                    search_chord = search_chord.replace(pat, "")
+
+            if pattern is None and MidiWrite.custom_index is not None:
+                for pat in re.findall(r'\d+/\d+:\d+', search_chord):
+                    if MidiWrite.debug:
+                        print("Pattern not found in default, searching {}...".format(MidiWrite.custom_file))
+                    custom_pattern = MidiWrite.custom_index.pattern(pat)
+                    if custom_pattern is not None:
+                        pattern = custom_pattern
                         search_chord = search_chord.replace(pat, "")
 
             # check for arpeggio flags
@@ -524,21 +1220,34 @@ class MidiWrite:
                         note_type = flag[1:]
                         search_chord = search_chord.replace(flag, '')
                     elif flag in search_chord and found_flags:
-                        print(search_chord)
-                        print("Error: time flag already selected: -" + note_type)
-                        exit(1)
+                        raise FlagError("time flag {} given after -{} in {}".format(flag, note_type, chord), chord)
 
+            # check for octave flags (stripped before roman numerals are resolved, 'v' would match)
+            for flag, offset in MidiWrite.octave_flags.items():
+                if flag in search_chord:
+                    octave += offset
+                    search_chord = search_chord.replace(flag, '')
+
+        return search_chord, arpeggiate, arp_rev, note_type, pattern, octave
+
+    @staticmethod
+    def chord_shape(chord, mode="cn_mode") -> [int]:
+        """
+        determine the notes of the chord based on chord type / fret locations
+        :param chord: the chord to find the notes of
+        :param mode: the type of chords entered (normal / roman numeral)
+        :return: the chord as a set of integer notes
+        """
+        search_chord, arpeggiate, arp_rev, note_type, pattern, octave = MidiWrite.chord_flags(chord)
+
+        if isinstance(chord, str):
             if mode == 'rn_mode':
-                base = None
+                base = ToneHelper.pitch_class(ToneHelper.key_root(MidiWrite.key_signature))
+                flats = ToneHelper.get_key(MidiWrite.key_signature)[0] < 0
                 secondary_chord = False
 
                 sfs = ["bb", "b", "#", "##"]
 
-                for element in ToneHelper.scale_dict:
-                    if element in MidiWrite.key_signature:
-                        base = element
-                        break
-
                 for value in ToneHelper.rn_scale:
                     if value in search_chord.lower():
                         acc = None
@@ -557,12 +1266,12 @@ class MidiWrite:
                                     primary_value = primary_value.replace(accidentals, "")
                                     search_chord = search_chord.replace(accidentals, "")
 
-                            adjust = ToneHelper.shift_to_scale(primary_value, base)
+                            adjust = ToneHelper.scale_degree(primary_value, base)
 
                             if acc is not None:
                                 adjust = ToneHelper.sharp_flat_shifted_note(acc, secondary_value, adjust)
                             else:
-                                adjust = ToneHelper.shift_to_scale(secondary_value, adjust)
+                                adjust = ToneHelper.scale_degree(secondary_value, adjust)
                         else:
                             primary_value = None
                             for accidentals in sfs:
@@ -574,13 +1283,15 @@ class MidiWrite:
                             if acc is not None:
                                 adjust = ToneHelper.sharp_flat_shifted_note(acc, primary_value, base)
                             else:
-                                adjust = ToneHelper.shift_to_scale(value, base)
+                                adjust = ToneHelper.scale_degree(value, base)
 
+                        # the root is only spelled to be read back as a chord name
+                        root = ToneHelper.name(adjust, flats=flats)
                         if value.upper() in search_chord:
-                            search_chord = search_chord.replace(value.upper(), adjust + "maj")
+                            search_chord = search_chord.replace(value.upper(), root + "maj")
 
                         else:
-                            search_chord = search_chord.replace(value.lower(), adjust + "m")
+                            search_chord = search_chord.replace(value.lower(), root + "m")
 
                         if "7" in search_chord and secondary_chord:
                             search_chord = search_chord.replace("maj", "").replace("m", "")
@@ -595,128 +1306,220 @@ class MidiWrite:
 
                         break
 
-            # look for note and chord type in dictionaries
-            for element in MidiWrite.note_map:
-                if element in search_chord:
-                    base = MidiWrite.note_map[element]
-                    if '%' not in search_chord:
-                        for c_shape in ToneHelper.chord_dict:
-                            if c_shape in search_chord:
-                                if "***" in search_chord:
-                                    if MidiWrite.debug:
-                                        statement = "Found chord"
-                                        print(statement)
-                                        print("=" * len(statement))
-                                        print("Chord [{}] found: [{}]\n".format(search_chord, str(c_shape + "**")))
-                                    return [24 + base + i for i in ToneHelper.chord_dict[c_shape]], arpeggiate, arp_rev, note_type, pattern
-                                elif "**" in search_chord:
-                                    if MidiWrite.debug:
-                                        statement = "Found chord"
-                                        print(statement)
-                                        print("=" * len(statement))
-                                        print("Chord [{}] found: [{}]\n".format(search_chord, str(c_shape + "*")))
-                                    return [12 + base + i for i in ToneHelper.chord_dict[c_shape]], arpeggiate, arp_rev, note_type, pattern
-                                elif "*" in search_chord:
-                                    if MidiWrite.debug:
-                                        statement = "Found chord"
-                                        print(statement)
-                                        print("=" * len(statement))
-                                        print("Chord [{}] found: [{}]\n".format(search_chord, str(c_shape)))
-                                    return [base + i for i in ToneHelper.chord_dict[c_shape]], arpeggiate, arp_rev, note_type, pattern
-                    else:
-                        # look for chord in separate custom file
-                        # custom file defines chords like so: <chord> : <[notes]> or <chord>:<fret notation>
-                        # e.g. F7%, F7%[2], etc
-                        custom_dict = {}
-                        if MidiWrite.custom_file is not None:
-                            with open(MidiWrite.custom_file, 'r') as f:
-                                for line in f:
-                                    definition = line.split(":")
-
-                                    # fret-notation
-                                    if 'x' in definition[1] or any(char.isdigit() for char in definition[1]):
-                                        search_chord = definition[1]
-                                        break
-
-                                    definition_edit = [int(j) for j in definition[1].split(",")]
-
-                                    if definition[0].split("%")[1] != "":
-                                        chord_name = definition[0].split("%")[0]
-                                        def_no     = definition[0].split("%")[1]
-                                        custom_dict[str(chord_name + def_no)] = definition_edit
-                                    else:
-                                        custom_dict[definition[0]] = definition_edit
-
-                            for custom_c_shape in custom_dict:
-                                if custom_c_shape in search_chord:
-                                    return [base + int(i) for i in custom_dict[custom_c_shape]], arpeggiate, arp_rev, note_type, pattern
+            # look the chord type up by name: the chord dictionary, then the generated vocabulary
+            match = MidiWrite.chord_name.match(search_chord)
+            if match is not None:
+                root, c_type, marker = match.groups()
+                intervals = MidiWrite.named_intervals(root, c_type, marker)
+                if intervals is not None:
+                    if MidiWrite.debug:
+                        statement = "Found chord"
+                        print(statement)
+                        print("=" * len(statement))
+                        print("Chord [{}] found: [{}{}]\n".format(search_chord, c_type, marker))
+                    base = MidiWrite.note_map["C"] + ToneHelper.pitch_class(root) + octave + \
+                        12 * MidiWrite.root_markers.index(marker)
+                    return [base + i for i in intervals], arpeggiate, arp_rev, note_type, pattern
+
+            # look for the chord type in the chord dictionary or the custom chord library, the root is the first note
+            # name in the chord
+            element = MidiWrite.root_name.search(search_chord)
+            if element is not None:
+                element = element.group()
+                base = MidiWrite.note_map["C"] + ToneHelper.pitch_class(element) + octave
+                if '%' not in search_chord:
+                    for c_shape in ToneHelper.chord_dict:
+                        if c_shape in search_chord:
+                            if "***" in search_chord:
+                                if MidiWrite.debug:
+                                    statement = "Found chord"
+                                    print(statement)
+                                    print("=" * len(statement))
+                                    print("Chord [{}] found: [{}]\n".format(search_chord, c_shape))
+                                return [24 + base + i for i in ToneHelper.chord_dict[c_shape]], arpeggiate, arp_rev, note_type, pattern
+                            elif "**" in search_chord:
+                                if MidiWrite.debug:
+                                    statement = "Found chord"
+                                    print(statement)
+                                    print("=" * len(statement))
+                                    print("Chord [{}] found: [{}]\n".format(search_chord, c_shape))
+                                return [12 + base + i for i in ToneHelper.chord_dict[c_shape]], arpeggiate, arp_rev, note_type, pattern
+                            elif "*" in search_chord:
+                                if MidiWrite.debug:
+                                    statement = "Found chord"
+                                    print(statement)
+                                    print("=" * len(statement))
+                                    print("Chord [{}] found: [{}]\n".format(search_chord, c_shape))
+                                return [base + i for i in ToneHelper.chord_dict[c_shape]], arpeggiate, arp_rev, note_type, pattern
+                else:
+                    # look for chord in the custom chord library
+                    # custom file defines chords like so: <chord> : <[notes]> or <chord>:<fret notation>
+                    # e.g. F7%, F7%[2], etc
+                    definition = None
+                    if MidiWrite.custom_index is not None:
+                        name = search_chord[search_chord.index(element) + len(element):]
+                        definition = MidiWrite.custom_index.chord(name)
+                        if definition is None:
+                            definition = MidiWrite.custom_index.chord(search_chord)
+
+                    if definition is None and MidiWrite.custom_file is None:
+                        raise ChordError("Chord " + search_chord + " needs a custom file, but none is set.", chord)
+                    if definition is None:
+                        raise ChordError("Chord " + search_chord + " not found in custom file " +
+                                         MidiWrite.custom_file + ".", chord)
+
+                    if not isinstance(definition, str):
+                        return [base + i for i in definition], arpeggiate, arp_rev, note_type, pattern
+                    search_chord = definition  # fret-notation, read below
 
         # assume chord is in fret-notation
         if 'x' not in search_chord and not any(char.isdigit() for char in search_chord):
-            print("Chord " + search_chord + " not found. Either chord has not been added or chord is incorrectly typed.")
-            return [0], False, False, note_type
+            raise ChordError("Chord " + search_chord + " not found. Either chord has not been added or chord is "
+                             "incorrectly typed.", chord)
+
+        search_chord = search_chord.strip()  # flags removed from e.g. "-q x32010" leave a space behind
 
         if MidiWrite.debug:
             print("Assuming [{}] to be in fret notation.\n".format(search_chord))
 
+        # the note map holds octave 2, open strings sound an octave above it
+        lowest = MidiWrite.note_map["C"] + 12 + octave
         notes = []
-        octaves = [0, 0, 0, 0, 0, 0]
-        if Misc.is_number(search_chord[0]):
-            shift = int(search_chord[0]) // 12
-            octaves[0] = shift
-            notes.append(ToneHelper.guitar_map_standard_tuning["E"][int(search_chord[0]) % 12])  # octaves repeat
-        else:
-            if MidiWrite.debug and search_chord[0] != 'x':
-                print("Invalid character found, is ignored.")
-        if Misc.is_number(search_chord[1]):
-            shift = int(search_chord[1]) // 12
-            octaves[1] = shift
-            notes.append(ToneHelper.guitar_map_standard_tuning["A"][int(search_chord[1]) % 12])
-        else:
-            if MidiWrite.debug and search_chord[1] != 'x':
-                print("Invalid character found, is ignored.")
-        if Misc.is_number(search_chord[2]):
-            shift = int(search_chord[2]) // 12
-            octaves[2] = shift
-            notes.append(ToneHelper.guitar_map_standard_tuning["D"][int(search_chord[2]) % 12])
-        else:
-            if MidiWrite.debug and search_chord[2] != 'x':
-                print("Invalid character found, is ignored.")
-        if Misc.is_number(search_chord[3]):
-            shift = int(search_chord[3]) // 12
-            octaves[3] = shift
-            notes.append(ToneHelper.guitar_map_standard_tuning["G"][int(search_chord[3]) % 12])
-        else:
-            if MidiWrite.debug and search_chord[3] != 'x':
-                print("Invalid character found, is ignored.")
-        if Misc.is_number(search_chord[4]):
-            shift = int(search_chord[4]) // 12
-            octaves[4] = shift
-            notes.append(ToneHelper.guitar_map_standard_tuning["B"][int(search_chord[4]) % 12])
-        else:
-            if MidiWrite.debug and search_chord[4] != 'x':
-                print("Invalid character found, is ignored.")
-        if Misc.is_number(search_chord[5]):
-            shift = int(search_chord[5]) // 12
-            octaves[5] = shift
-            notes.append(ToneHelper.guitar_map_standard_tuning["E"][int(search_chord[5]) % 12])
-        else:
-            if MidiWrite.debug and search_chord[5] != 'x':
+        for string, fret in enumerate(search_chord[:6]):
+            if Misc.is_number(fret):
+                fret = int(fret)
+                notes.append(lowest + (ToneHelper.standard_tuning[string] + fret) % 12 + 12 * (fret // 12))
+            elif MidiWrite.debug and fret != 'x':
                 print("Invalid character found, is ignored.")
 
-        for i in range(len(notes)):
-            if len(notes[i]) > 2:
-                notes[i] = notes[i][:2]
-            for key, value in MidiWrite.note_map.items():
-                if key in notes[i]:
-                    notes[i] = MidiWrite.note_map[key] + (12 * (1 + octaves[i]))
-                    break
-
         if MidiWrite.debug:
             print("Fret notation chord [{}] created.\n".format(search_chord))
 
         return notes, arpeggiate, arp_rev, note_type, pattern
 
+    @staticmethod
+    def named_intervals(root: str, c_type: str, marker: str) -> [int]:
+        """
+        Finds the intervals of a chord type by name.
+        Chord types in the chord dictionary use its single-* voicing for every root string (the root string only sets
+        the octave); any other chord type is built by ChordVocabulary.
+        :param root: the root of the chord
+        :param c_type: the chord type, e.g. 'maj7' or 'm9'
+        :param marker: the root-string marker
+        :return: the intervals of the chord above the root string's octave, or None if the chord type is not known
+        """
+        if c_type + "*" in ToneHelper.chord_dict:
+            return ToneHelper.chord_dict[c_type + "*"]
+
+        return ChordVocabulary.shape(root, c_type, marker)
+
+    @staticmethod
+    def voicings(chord: str, mode="cn_mode") -> [(str, [int])]:
+        """
+        Lists every distinct voicing a chord can be played in, over the root-string markers and octave flags.
+        Chord dictionary types have one shape that each root string only moves by an octave, so several commands give
+        the same notes; only the first of them is kept. Chords that already name a root string, custom chords, fret
+        notation and single notes only have themselves as a candidate.
+        :param chord: the chord to voice
+        :param mode: the type of chords entered (normal / roman numeral)
+        :return: list of (command, notes) candidates
+        """
+        if not isinstance(chord, str) or '*' in chord or '%' in chord or re.search(r'[x\d]{6}', chord) \
+                or MidiWrite.section_ref(chord) is not None or MidiWrite.note_token.match(chord):
+            return [(chord, None)]
+
+        try:
+            MidiWrite.resolve(chord + MidiWrite.root_markers[0], mode=mode)
+        except MidiWriteError:  # chord not found, leave it to find_notes
+            return [(chord, None)]
+
+        candidates = []
+        seen = set()
+        for marker in MidiWrite.root_markers:
+            for flag in ['-8vb', '', '-8va']:
+                command = flag + chord + marker
+                try:
+                    notes = MidiWrite.resolve(command, mode=mode)[0]
+                except MidiWriteError:  # out of the midi range
+                    continue
+                if tuple(notes) not in seen:
+                    seen.add(tuple(notes))
+                    candidates.append((command, notes))
+
+        return candidates
+
+    @staticmethod
+    def nearest_distances(notes: [int]) -> [int]:
+        """
+        Finds the distance from every midi note to the closest note of a chord.
+        Summing these over the notes of a neighbouring chord (and the other way around) gives the voice movement.
+        :param notes: the notes of the chord
+        :return: list of 128 distances in semitones, indexed by midi note
+        """
+        if not notes:
+            return [0 for _ in range(128)]
+
+        return [min(abs(p - note) for note in notes) for p in range(128)]
+
+    @staticmethod
+    def auto_voice(commands: [str], mode="cn_mode") -> [str]:
+        """
+        Picks the voicing of every chord that does not name a root string so that the voices move as little as possible
+        over the whole progression (Viterbi search, linear in the length of the progression). For chord dictionary
+        types this places the chord's one shape in an octave; vocabulary chords also choose between root strings.
+        :param commands: the chords of the progression
+        :param mode: the type of chords entered (normal / roman numeral)
+        :return: the commands with root-string markers and octave flags filled in
+        """
+        candidates = {}  # command -> [(command, notes)]
+        distances = {}  # command -> nearest-note distances of every candidate
+        transitions = {}  # (previous command, command) -> per candidate, cost from every previous candidate
+
+        for chord in commands:
+            if chord not in candidates:
+                candidates[chord] = MidiWrite.voicings(chord, mode=mode)
+                distances[chord] = [MidiWrite.nearest_distances(notes) for _, notes in candidates[chord]]
+
+        costs = None
+        back = []
+        previous = None
+        for chord in commands:
+            if costs is None:
+                costs = [0] * len(candidates[chord])
+                back.append(None)
+            else:
+                if (previous, chord) not in transitions:
+                    transitions[(previous, chord)] = [
+                        [sum(to_b[x] for x in a or []) + sum(to_a[y] for y in b or [])
+                         for (_, a), to_a in zip(candidates[previous], distances[previous])]
+                        for (_, b), to_b in zip(candidates[chord], distances[chord])
+                    ]
+
+                new_costs = []
+                pointers = []
+                for column in transitions[(previous, chord)]:
+                    totals = [cost + move for cost, move in zip(costs, column)]
+                    best = min(totals)
+                    new_costs.append(best)
+                    pointers.append(totals.index(best))
+
+                costs = new_costs
+                back.append(pointers)
+            previous = chord
+
+        if costs is None:
+            return []
+
+        # walk the cheapest path back from the last chord
+        voiced = [None for _ in range(len(commands))]
+        choice = costs.index(min(costs))
+        for i in range(len(commands) - 1, -1, -1):
+            voiced[i] = candidates[commands[i]][choice][0]
+            if back[i] is not None:
+                choice = back[i][choice]
+
+        return voiced
+
     @staticmethod
     def get_chords(c_type: str) -> [str]:
         """
@@ -1,11 +1,21 @@
 # markup file parser for MidiWrite
 
+import os
 import sys
+import time
+from errors import MarkupError, MidiWriteError
 from midi_writer import MidiWrite
+from pipeline import Pipeline
+from ToneHelper import ToneHelper
 
-if __name__ == "__main__":
-    file = sys.argv[1]
-    output_file = file[:-4] + ".midi"
+
+def read_markup(file: str) -> dict:
+    """
+    Reads a markup file.
+    :param file: the markup file
+    :return: the title, prefix settings, custom file, mode, commands and sections of the file, and the problems that do
+             not stop it from being read (under "diagnostics")
+    """
     custom_file = None
     mode = "cn_mode"
     title = None
@@ -13,15 +23,12 @@ if __name__ == "__main__":
     tempo = 120
     time_sig = "4/4"
     key_sig = "Cmaj"
+    auto_voice = False
     command_listing = False
     commands = []
-
-    was_prefix = False
-
-    if len(sys.argv) > 2:
-        octave_shift = int(sys.argv[2])
-    else:
-        octave_shift = None
+    sections = {}
+    section = None  # name of the section being listed
+    diagnostics = []
 
     i = 0
     with open(file, 'r') as f:
@@ -31,36 +38,53 @@ if __name__ == "__main__":
             line = line.strip()[1:-1]
             if first_line:
                 if not line.startswith("begin"):
-                    print("Error in [%s]: file does not start with 'begin' [line: %d]" % (file, i + 1))
-                    exit(1)
+                    raise MarkupError("file does not start with 'begin'", file, i + 1)
                 else:
                     title = line.split(" ")[1]
 
+            if section is not None:
+                if line == "/section":
+                    section = None
+                else:
+                    sections[section] += line.replace("\"", "").replace(" ", "").split(',')
+
             if command_listing:
                 if line == "/commands":
                     command_listing = False
                 else:
                     commands += line.replace("\"", "").replace(" ", "").split(',')
                     if line.startswith("end"):
-                        print("Error in [%s]: Commands not finished [line: %d]" % (file, i + 1))
+                        diagnostics.append(MarkupError("Commands not finished", file, i + 1))
 
             if prefix:
-                if line.startswith("time-sig"):
-                    time_sig = line.split("=")[1]
-                elif line.startswith("tempo"):
-                    tempo = int(line.split("=")[1])
-                elif line.startswith("key-sig"):
-                    key_sig = line.split("=")[1]
-                elif line.startswith("mode"):
-                    mode = line.split("=")[1]
-                elif line.startswith("ppq"):
-                    ppq = line.split("=")[1]
-                elif line == "/prefix":
-                    if prefix:
-                        prefix = False
-                else:
-                    print("Error in [%s]: variable declaration outside of prefix [line: %d]" % (file, i + 1))
-                    exit(1)
+                try:
+                    if line.startswith("time-sig"):
+                        time_sig = line.split("=")[1]
+                        numerator, denominator = [int(n) for n in time_sig.split("/")]
+                        if numerator < 1 or denominator not in (1, 2, 4, 8, 16, 32):
+                            raise ValueError(time_sig)
+                    elif line.startswith("tempo"):
+                        tempo = int(line.split("=")[1])
+                    elif line.startswith("key-sig"):
+                        key_sig = line.split("=")[1]
+                        ToneHelper.get_key(key_sig)  # raises a ChordError for unknown keys
+                    elif line.startswith("mode"):
+                        mode = line.split("=")[1]
+                        if mode not in ("cn_mode", "rn_mode"):
+                            raise ValueError(mode)
+                    elif line.startswith("voicing"):
+                        auto_voice = line.split("=")[1] == "auto"
+                    elif line.startswith("ppq"):
+                        ppq = int(line.split("=")[1])
+                    elif line == "/prefix":
+                        if prefix:
+                            prefix = False
+                    else:
+                        raise MarkupError("variable declaration outside of prefix", file, i + 1)
+                except (IndexError, ValueError) as error:
+                    if isinstance(error, MarkupError):
+                        raise
+                    raise MarkupError("invalid value in <{}>".format(line), file, i + 1) from error
             else:
                 if line.startswith("custom_file"):
                     custom_file = line.split("=")[1][1:-1]
@@ -68,37 +92,174 @@ if __name__ == "__main__":
                 if line == "commands":
                     command_listing = True
 
+                if line.startswith("section "):
+                    section = line.split(" ")[1]
+                    sections[section] = []
+
             if line == "prefix":
                 prefix = True
-                was_prefix = True
 
             first_line = False
 
             if line.startswith("end"):
                 if title != line.split(" ")[1]:
-                    print("Error in [%s]: beginning and end tags do not match titles [line: %d]" % (file, i + 1))
-                    exit(1)
+                    raise MarkupError("beginning and end tags do not match titles", file, i + 1)
 
             i += 1
 
+    return dict(title=title, custom_file=custom_file, mode=mode, ppq=ppq, tempo=tempo, time_sig=time_sig,
+                key_sig=key_sig, auto_voice=auto_voice, commands=commands, sections=sections, diagnostics=diagnostics)
+
+
+def validate(file: str) -> [MidiWriteError]:
+    """
+    Checks a markup file without rendering it.
+    :param file: the markup file
+    :return: the errors found
+    """
+    try:
+        markup = read_markup(file)
+    except (OSError, UnicodeDecodeError) as error:
+        return [MarkupError("file cannot be read ({})".format(error), file, 0)]
+    except MarkupError as error:
+        return [error]
+
+    try:
+        MidiWrite.set_custom_file(markup["custom_file"])
+    except (OSError, ValueError) as error:
+        return markup["diagnostics"] + [MarkupError("custom file cannot be read ({})".format(error), file, 0)]
+
+    return markup["diagnostics"] + MidiWrite.validate(markup["commands"], mode=markup["mode"], key=markup["key_sig"],
+                                                      sections=markup["sections"])
+
+
+def markup_files(paths: [str]) -> [str]:
+    """
+    Lists markup files, looking through directories.
+    :param paths: markup files and directories
+    :return: the markup files
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, files in sorted(os.walk(path)):
+                for name in sorted(files):
+                    if name.endswith(".mwm"):
+                        yield os.path.join(directory, name)
+        else:
+            yield path
+
+
+def describe(error: MidiWriteError, file: str) -> str:
+    """
+    Formats an error for the command line.
+    :param error: the error
+    :param file: the markup file it was found in
+    :return: the message
+    """
+    if isinstance(error, MarkupError):
+        return str(error)
+
+    return "Error in [{}]: {} [command: {}]".format(file, error, error.command)
+
+
+if __name__ == "__main__":
+    # preview options: --bars=first-last or --commands=first-last renders only that part to [name]_preview.midi
+    # --index also writes a sidecar index of the bars and commands of the track ([output file].mwti)
+    # --validate checks markup files (and the .mwm files in directories) without rendering them
+    # --pipeline renders through the threaded pipeline (pipeline.py) and prints the report of its stages
+    options = dict((arg[2:].split("=", 1) + [None])[:2] for arg in sys.argv[1:] if arg.startswith("--"))
+    index = "index" in options
+    args = [arg for arg in sys.argv if not arg.startswith("--")]
+
+    bars = None
+    command_range = None
+    if "bars" in options:
+        bars = tuple(int(n) for n in options["bars"].split("-"))
+    if "commands" in options:
+        command_range = tuple(int(n) for n in options["commands"].split("-"))
+
+    if "validate" in options:
+        start = time.perf_counter()
+        checked = failed = 0
+        for markup_file in markup_files(args[1:]):
+            errors = validate(markup_file)
+            checked += 1
+            failed += 1 if errors else 0
+            for error in errors:
+                print(describe(error, markup_file))
+
+        print("Checked {} files in {:.2f} s: {} with errors".format(checked, time.perf_counter() - start, failed))
+        exit(1 if failed else 0)
+
+    file = args[1]
+    output_file = file[:-4] + ("_preview.midi" if bars or command_range else ".midi")
+
+    if len(args) > 2:
+        octave_shift = int(args[2])
+    else:
+        octave_shift = None
+
+    if len(args) > 3:
+        workers = int(args[3])
+    else:
+        workers = 1
+
+    pipeline = None
+    if "pipeline" in options:
+        if workers > 1:
+            print("--pipeline renders on threads and cannot be combined with worker processes.")
+            exit(1)
+        pipeline = Pipeline()
+
+    try:
+        markup = read_markup(file)
+    except MarkupError as error:
+        print(error)
+        exit(1)
+
+    for error in markup["diagnostics"]:
+        print(error)
+
+    title, custom_file, mode, ppq, tempo = markup["title"], markup["custom_file"], markup["mode"], markup["ppq"], \
+        markup["tempo"]
+    time_sig, key_sig, auto_voice = markup["time_sig"], markup["key_sig"], markup["auto_voice"]
+    commands, sections = markup["commands"], markup["sections"]
+
     MidiWrite.set_custom_file(custom_file)
 
     MidiWrite.write_preqs(output_file, time=time_sig, tempo=tempo, ppq=ppq)
 
+    track_options = dict(shift=octave_shift, mode=mode, auto_voice=auto_voice, sections=sections, bars=bars,
+                         command_range=command_range, index=index)
+    if pipeline is not None:
+        write_track = pipeline.write_track
+    else:
+        write_track = MidiWrite.write_track
+        track_options["workers"] = workers
+
     if time_sig is None:
         if tempo is not None and key_sig is None:
-            MidiWrite.write_track(output_file, commands, title=title, shift=octave_shift, mode=mode)
+            write_track(output_file, commands, title=title, **track_options)
         elif tempo is None and key_sig is not None:
-            MidiWrite.write_track(output_file, commands, title=title, key=key_sig, shift=octave_shift, mode=mode)
+            write_track(output_file, commands, title=title, key=key_sig, **track_options)
     elif tempo is None:
         if key_sig is None:
-            MidiWrite.write_track(output_file, commands, title=title, shift=octave_shift, mode=mode)
+            write_track(output_file, commands, title=title, **track_options)
         else:
-            MidiWrite.write_track(output_file, commands, title=title, key=key_sig, shift=octave_shift, mode=mode)
+            write_track(output_file, commands, title=title, key=key_sig, **track_options)
     elif key_sig is None:
         if tempo is None:
-            MidiWrite.write_track(output_file, commands, title=title, key=key_sig, shift=octave_shift, mode=mode)
+            write_track(output_file, commands, title=title, key=key_sig, **track_options)
         else:
-            MidiWrite.write_track(output_file, commands, title=title, shift=octave_shift, mode=mode)
+            write_track(output_file, commands, title=title, **track_options)
     else:
-        MidiWrite.write_track(output_file, commands, title=title, key=key_sig, shift=octave_shift, mode=mode)
+        write_track(output_file, commands, title=title, key=key_sig, **track_options)
+
+    if pipeline is not None:
+        print(pipeline.report())
+
+    # commands that could not be played were written as placeholder notes
+    for error in MidiWrite.diagnostics:
+        print(describe(error, file))
+    if MidiWrite.diagnostics:
+        exit(1)
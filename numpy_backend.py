@@ -0,0 +1,182 @@
+# vectorized encoder for batches of progressions (requires numpy)
+#
+# A batch is a set of progressions of the same length that use the same chord types and root strings at each
+# position and only differ in roots and note lengths, e.g. transpositions of a progression for a dataset.
+# Every note-on, note-off and delta time of the whole batch is computed with array operations, and the output is
+# byte for byte what MidiWrite.find_notes / write_track produce.
+
+import re
+from midi_writer import MidiWrite
+from ToneHelper import ToneHelper
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# [time flag] root chord-type root-string-marker, e.g. "-q Dbmaj7**"
+command_pattern = re.compile(r'^(-o|-\.?[whqest])?\s*([A-G][#b]?)([^*\s%]+)(\*{1,3})$')
+
+marker_offsets = {"*": 0, "**": 12, "***": 24}
+
+
+class NumpyBackend:
+    @staticmethod
+    def available() -> bool:
+        """
+        Checks whether numpy can be imported.
+        :return: true if the backend can be used
+        """
+        return np is not None
+
+    @staticmethod
+    def parse(command: str) -> (str, str, (int,), str):
+        """
+        Splits a block chord command into its parts, resolving the chord type by name the same way
+        MidiWrite.chord_shape does (the chord dictionary, then the generated vocabulary).
+        :param command: the command, e.g. "-q Dbmaj7**"
+        :return: (note type, root, intervals of the chord above the root string's octave, root-string marker)
+        """
+        match = command_pattern.match(command) if isinstance(command, str) else None
+        if match is None:
+            raise ValueError("command {} is not a block chord the numpy backend can encode".format(command))
+
+        flag, root, c_type, marker = match.groups()
+        intervals = MidiWrite.named_intervals(root, c_type, marker)
+        if intervals is None:
+            raise ValueError("chord type of {} is not in the chord dictionary or vocabulary".format(command))
+
+        return (flag[1:] if flag else 'd'), root, tuple(intervals), marker
+
+    @staticmethod
+    def encode_batch(progressions: [[str]]) -> [bytes]:
+        """
+        Encodes a batch of progressions.
+        :param progressions: the progressions, all of the same length and with the same chord types at each position
+        :return: the encoded events of each progression
+        """
+        if np is None:
+            raise ImportError("the numpy backend requires numpy")
+        if not progressions:
+            return []
+
+        batch, length = len(progressions), len(progressions[0])
+        if any(len(progression) != length for progression in progressions):
+            raise ValueError("progressions in a batch must have the same length")
+
+        # datasets reuse the same few hundred commands, so each distinct command is only parsed once
+        commands = {}
+        for progression in progressions:
+            for command in progression:
+                if command not in commands:
+                    commands[command] = NumpyBackend.parse(command)
+        parsed = [[commands[command] for command in progression] for progression in progressions]
+
+        # chord shapes shared by the batch: interval of every note (including the root-string offset)
+        # and the position each note belongs to
+        intervals = []
+        note_position = []
+        sizes = []
+        for n in range(length):
+            shape, marker = parsed[0][n][2], parsed[0][n][3]
+            if any(p[n][2] != shape or p[n][3] != marker for p in parsed):
+                raise ValueError("progressions in a batch must use the same chord types at position {}".format(n))
+            intervals += [marker_offsets[marker] + i for i in shape]
+            note_position += [n] * len(shape)
+            sizes.append(len(shape))
+
+        # pitches of every note of the batch: [batch, notes]
+        lowest = MidiWrite.note_map["C"]
+        roots = np.array([[lowest + ToneHelper.pitch_class(p[n][1]) for n in range(length)] for p in parsed],
+                         dtype=np.int32)
+        pitches = roots[:, note_position] + np.array(intervals, dtype=np.int32)
+        if pitches.min() < 0 or pitches.max() > 127:
+            raise ValueError("batch contains notes outside of the midi range")
+
+        # delay before the notes are turned off, right-aligned in a slot as wide as the longest delay: [batch, length]
+        delays = {}
+        note_types = [[p[n][0] for n in range(length)] for p in parsed]
+        for row in note_types:
+            for note_type in row:
+                if note_type not in delays:
+                    delays[note_type] = MidiWrite.note_delays(note_type)[0]
+        width = max(len(delay) for delay in delays.values())
+
+        type_ids = {note_type: i for i, note_type in enumerate(delays)}
+        delay_table = np.zeros((len(delays), width), dtype=np.uint8)
+        delay_valid = np.zeros((len(delays), width), dtype=bool)
+        for note_type, i in type_ids.items():
+            delay = delays[note_type]
+            delay_table[i, width - len(delay):] = list(delay)
+            delay_valid[i, width - len(delay):] = True
+        chosen = np.array([[type_ids[note_type] for note_type in row] for row in note_types], dtype=np.intp)
+
+        # byte template of the whole progression:
+        #   notes on:     00 90 [note] 40        for every note
+        #   first off:    [delay] [last note] 00
+        #   other offs:   00 [note] 00           for the remaining notes, last to first
+        template = []
+        pitch_columns, pitch_sources = [], []
+        delay_columns = []
+        note = 0
+        for n in range(length):
+            size = sizes[n]
+            for k in range(size):
+                template += [0x00, 0x90, 0, 0x40]
+                pitch_columns.append(len(template) - 2)
+                pitch_sources.append(note + k)
+
+            delay_columns.append(len(template))
+            template += [0] * width
+            template += [0, 0x00]
+            pitch_columns.append(len(template) - 2)
+            pitch_sources.append(note + size - 1)
+
+            for k in range(size - 1, 0, -1):
+                template += [0x00, 0, 0x00]
+                pitch_columns.append(len(template) - 2)
+                pitch_sources.append(note + k - 1)
+            note += size
+
+        out = np.tile(np.array(template, dtype=np.uint8), (batch, 1))
+        out[:, pitch_columns] = pitches[:, pitch_sources]
+
+        valid = np.ones(out.shape, dtype=bool)
+        slots = (np.array(delay_columns)[:, None] + np.arange(width)).ravel()
+        out[:, slots] = delay_table[chosen].reshape(batch, -1)
+        valid[:, slots] = delay_valid[chosen].reshape(batch, -1)
+
+        # drop the unused delay bytes and cut the result back into one buffer per progression
+        data = out[valid].tobytes()
+        ends = np.cumsum(valid.sum(axis=1)).tolist()
+        starts = [0] + ends[:-1]
+
+        return [data[start:end] for start, end in zip(starts, ends)]
+
+    @staticmethod
+    def write_batch(files: [str], progressions: [[str]], title='Main', key='Cmaj', time="4/4", tempo=120, ppq=96):
+        """
+        Renders a batch of progressions, one midi file each.
+        Batches the numpy backend cannot encode (or all batches, if numpy is missing) are encoded in pure Python.
+        :param files: the midi files to write to
+        :param progressions: the progressions
+        :param title: the title of the tracks
+        :param key: the key signature of the tracks
+        :param time: the time signature
+        :param tempo: the bpm
+        :param ppq: the parts per quarter
+        :return: none
+        """
+        MidiWrite.ppq = MidiWrite.write_var_len(ppq)
+        MidiWrite.key_signature = key
+
+        try:
+            encoded = NumpyBackend.encode_batch(progressions)
+        except (ImportError, ValueError) as e:
+            if MidiWrite.debug:
+                print("Numpy backend not used ({}), encoding in Python.".format(e))
+            encoded = [b''.join(MidiWrite.encode_commands(progression)) for progression in progressions]
+
+        for file, events in zip(files, encoded):
+            MidiWrite.write_preqs(file, time=time, tempo=tempo, ppq=ppq)
+            MidiWrite.write_encoded_track(file, [events], title=title, key=key)
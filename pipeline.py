@@ -0,0 +1,287 @@
+# pipelined renderer: parse -> resolve -> encode -> write, each stage on its own thread
+#
+# Stages pass batches of chords to the next one through bounded queues. A slow stage makes the stages before it wait
+# (back-pressure) instead of letting work pile up in memory, and earlier batches are written to disk while later ones
+# are still being encoded. Every stage records how long it waited for input (starved) and for room in its output
+# queue (stalled), and how full that queue got, so the bottleneck shows up in the report: it is the stage that is
+# neither starved nor stalled, with a full queue in front of it.
+
+import queue
+import threading
+import time
+from errors import MidiWriteError
+from midi_writer import MidiWrite
+
+stages = ["parse", "resolve", "encode", "write"]
+
+done = None  # marks the end of the stream in a queue
+command_start = object()  # marks where a command starts in a batch, only used when writing a track index
+
+
+class Aborted(Exception):
+    """
+    Raised in a stage when another stage has failed.
+    """
+    pass
+
+
+class Pipeline:
+    def __init__(self, batch_size=256, depth=4):
+        """
+        Sets up a pipeline.
+        :param batch_size: number of chords per batch
+        :param depth: number of batches each queue holds before the stage filling it has to wait
+        """
+        self.batch_size = batch_size
+        self.depth = depth
+        self.queues = []
+        self.stats = {}
+        self.failed = threading.Event()
+        self.error = None
+
+    def get(self, index: int, stage: str):
+        """
+        Takes the next batch from a queue, waiting while it is empty.
+        :param index: the queue
+        :param stage: the stage taking the batch
+        :return: the batch
+        """
+        start = time.perf_counter()
+        while True:
+            try:
+                batch = self.queues[index].get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self.failed.is_set():
+                    raise Aborted()
+        self.stats[stage]["starved"] += time.perf_counter() - start
+
+        return batch
+
+    def put(self, index: int, stage: str, batch):
+        """
+        Hands a batch to the next stage, waiting while its queue is full.
+        :param index: the queue
+        :param stage: the stage handing over the batch
+        :param batch: the batch
+        :return: none
+        """
+        stats = self.stats[stage]
+        depth = self.queues[index].qsize()
+        stats["max_depth"] = max(stats["max_depth"], depth)
+        stats["depth"] += depth
+
+        start = time.perf_counter()
+        while True:
+            try:
+                self.queues[index].put(batch, timeout=0.1)
+                break
+            except queue.Full:
+                if self.failed.is_set():
+                    raise Aborted()
+        stats["stalled"] += time.perf_counter() - start
+
+        if batch is not done:
+            stats["batches"] += 1
+
+    def parse(self, commands, arpeggiate, flip, index):
+        """
+        Reads the commands (which may be generated lazily, e.g. from a file), expands sections and batches the chords
+        together with their arpeggio flip state. When indexing, each command is preceded by command_start (a section
+        repeat counts as one command).
+        """
+        def expand(commands):
+            nonlocal flip
+            for command in commands:
+                ref = MidiWrite.section_ref(command)
+                if ref is not None:
+                    name, count = ref
+                    for _ in range(count):
+                        yield from expand(MidiWrite.sections[name])
+                    continue
+
+                yield command, flip
+                if arpeggiate:
+                    flip = not flip
+
+        def mark(commands):
+            for command in commands:
+                yield command_start
+                yield from expand([command])
+
+        batch = []
+        for chord in mark(commands) if index else expand(commands):
+            batch.append(chord)
+            if len(batch) == self.batch_size:
+                self.put(0, "parse", batch)
+                batch = []
+
+        if batch:
+            self.put(0, "parse", batch)
+        self.put(0, "parse", done)
+
+    def resolve(self, mode):
+        """
+        Resolves the notes and flags of each chord. Progressions repeat the same chords, so each one is only resolved
+        once. Single notes and scale runs are encoded right away, and so are placeholders for commands that cannot be
+        played (the error goes to MidiWrite.diagnostics).
+        """
+        shapes = {}
+
+        while True:
+            batch = self.get(0, "resolve")
+            if batch is done:
+                break
+
+            resolved = []
+            for item in batch:
+                if item is command_start:
+                    resolved.append(item)
+                    continue
+                chord, flip = item
+                try:
+                    melody = MidiWrite.encode_melody(chord)
+                    if melody is not None:
+                        resolved.append((melody, flip))
+                        continue
+                    if not isinstance(chord, str):
+                        resolved.append((MidiWrite.resolve(chord, mode=mode), flip))
+                        continue
+                    if chord not in shapes:
+                        shapes[chord] = MidiWrite.resolve(chord, mode=mode)
+                    resolved.append((shapes[chord], flip))
+                except MidiWriteError as error:
+                    MidiWrite.report(error, chord)
+                    resolved.append((b''.join(MidiWrite.placeholder()), flip))
+
+            self.put(1, "resolve", resolved)
+
+        self.put(1, "resolve", done)
+
+    def encode(self):
+        """
+        Encodes each batch of resolved chords into one block of events (one per command when indexing).
+        """
+        def blocks(batch):
+            block = []
+            for item in batch:
+                if item is command_start:
+                    if block:
+                        yield b''.join(block)
+                        block = []
+                    yield item
+                    continue
+                shape, flip = item
+                block.append(shape if isinstance(shape, bytes) else b''.join(MidiWrite.encode_notes(*shape, flip=flip)))
+            if block:
+                yield b''.join(block)
+
+        while True:
+            batch = self.get(1, "encode")
+            if batch is done:
+                break
+
+            self.put(2, "encode", list(blocks(batch)))
+
+        self.put(2, "encode", done)
+
+    def write(self, file, title, key, index):
+        """
+        Streams the encoded blocks into a track chunk, marking the start of each command in the index.
+        """
+        def blocks():
+            while True:
+                batch = self.get(2, "write")
+                if batch is done:
+                    return
+                self.stats["write"]["batches"] += 1
+                for block in batch:
+                    if block is command_start:
+                        index.command()
+                    else:
+                        yield block
+
+        MidiWrite.write_encoded_track(file, blocks(), title=title, key=key, index=index)
+
+    def run(self, stage: str, work, *args):
+        """
+        Runs a stage, stopping the other stages if it fails.
+        :param stage: the name of the stage
+        :param work: the stage's method
+        :param args: the arguments of the stage
+        :return: none
+        """
+        start = time.perf_counter()
+        try:
+            work(*args)
+        except Aborted:
+            pass
+        except BaseException as e:
+            if self.error is None:
+                self.error = e
+            self.failed.set()
+        self.stats[stage]["elapsed"] = time.perf_counter() - start
+
+    def write_track(self, file: str, commands, title='Main', key='Cmaj', mode="cn_mode", shift=0, arpeggiate=False,
+                    auto_voice=False, sections=None, bars=None, command_range=None, index=False) -> dict:
+        """
+        Writes the track data to the midi file through the pipeline. The output is identical to MidiWrite.write_track.
+        :param file: the midi file to write to (after MidiWrite.write_preqs)
+        :param commands: the commands (a list or any iterable, read lazily unless voiced automatically)
+        :param title: the title of the track
+        :param key: the key signature of the track
+        :param mode: the type of chords entered
+        :param shift: octave shift up / down
+        :param arpeggiate: arpeggiate every chord
+        :param auto_voice: pick root strings / octaves for chords without markers
+        :param sections: named sections of commands, repeated in commands with "@name:count"
+        :param bars: only write the chords starting in these bars, (first, last) counting from 1
+        :param command_range: only write these commands, (first, last) counting from 1
+        :param index: also write a sidecar index of the bars and commands of the track ([file].mwti)
+        :return: the statistics of each stage (errors found in the commands are in MidiWrite.diagnostics)
+        """
+        commands, flip, indexer = MidiWrite.prepare_track(commands, key=key, mode=mode, shift=shift,
+                                                          arpeggiate=arpeggiate, auto_voice=auto_voice,
+                                                          sections=sections, bars=bars, command_range=command_range,
+                                                          index=index)
+
+        self.queues = [queue.Queue(self.depth) for _ in range(len(stages) - 1)]
+        self.stats = {stage: dict(batches=0, elapsed=0.0, starved=0.0, stalled=0.0, max_depth=0, depth=0)
+                      for stage in stages}
+        self.failed.clear()
+        self.error = None
+
+        work = {"parse": (self.parse, commands, arpeggiate, flip, indexer is not None), "resolve": (self.resolve, mode),
+                "encode": (self.encode,), "write": (self.write, file, title, key, indexer)}
+        threads = [threading.Thread(target=self.run, args=(stage,) + work[stage], name=stage) for stage in stages]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+        for stats in self.stats.values():
+            stats["mean_depth"] = stats.pop("depth") / max(stats["batches"], 1)
+
+        return self.stats
+
+    def report(self) -> str:
+        """
+        Formats the statistics of the last run.
+        :return: one line per stage with its batches, time spent working, starved and stalled, and the depth of its
+                 output queue
+        """
+        lines = ["{:>8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+            "stage", "batches", "busy s", "starved s", "stalled s", "max queue", "mean queue")]
+
+        for stage in stages:
+            stats = self.stats[stage]
+            busy = stats["elapsed"] - stats["starved"] - stats["stalled"]
+            queued = (stats["max_depth"], "{:.2f}".format(stats["mean_depth"])) if stage != "write" else ("-", "-")
+            lines.append("{:>8} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10} {:>10}".format(
+                stage, stats["batches"], busy, stats["starved"], stats["stalled"], *queued))
+
+        return "\n".join(lines)
@@ -0,0 +1,183 @@
+# streams ASCII guitar tab into MidiWrite fret notation
+#
+# usage: python tab_import.py [tab file] [columns per quarter note](optional, default 4) [tempo](optional)
+#
+# e|-------0-------|
+# B|-----1---1-----|
+# G|---2-------2---|
+# D|-2-------------|
+# A|---------------|
+# E|---------------|
+#
+# Tab is read one system (six string lines) at a time and turned into commands column by column, so only the
+# current system is ever held in memory. The length of each note is the number of columns until the next one.
+
+import re
+import sys
+from chord_index import ChordIndex
+from errors import ChordError, NoteError
+from midi_import import MidiImport
+from midi_writer import MidiWrite
+from ToneHelper import ToneHelper
+
+# optional string name, optional bar, then the frets; the body has to contain dashes to count as tab
+tab_line = re.compile(r'^\s*(?:[A-Ga-g][#b]?\s*)?[|:]?(?P<body>[-0-9|hpbrsvx/\\~().^*]*-[-0-9|hpbrsvx/\\~().^*]*)')
+
+strings = 6
+
+
+class TabImport:
+    @staticmethod
+    def systems(lines):
+        """
+        Groups the lines of a tab file into systems of six strings, highest string first.
+        :param lines: the lines of the tab file
+        :return: generator of systems (lists of six string bodies)
+        """
+        system = []
+
+        for line in lines:
+            match = tab_line.match(line.rstrip("\n"))
+            if match is not None and len(match.group("body")) > 1:
+                system.append(match.group("body"))
+                if len(system) == strings:
+                    yield system
+                    system = []
+            elif system:
+                print("Skipping incomplete system of {} line(s).".format(len(system)))
+                system = []
+
+    @staticmethod
+    def columns(system: [str]):
+        """
+        Reads a system column by column.
+        :param system: the six string bodies, highest string first
+        :return: generator of frets (lowest string first, None if not played) for columns where a note starts,
+                 and None for columns that only take up time; bar lines are skipped
+        """
+        width = max(len(body) for body in system)
+        system = [body.ljust(width, "-") for body in system]
+
+        for col in range(width):
+            if all(body[col] == "|" for body in system):
+                continue
+
+            frets = [None for _ in range(strings)]
+            for i, body in enumerate(system):
+                # a digit right after another one is the second digit of the same fret
+                if body[col].isdigit() and (col == 0 or not body[col - 1].isdigit()):
+                    end = col + 1
+                    if end < width and body[end].isdigit():
+                        end += 1
+                    frets[strings - 1 - i] = int(body[col:end])
+
+            yield frets if any(fret is not None for fret in frets) else None
+
+    @staticmethod
+    def notes(frets: [int]) -> [int]:
+        """
+        Works out the notes of a column the way MidiWrite.chord_shape plays fret notation.
+        :param frets: the frets, lowest string first
+        :return: the midi notes, lowest string first
+        """
+        lowest = MidiWrite.note_map["C"] + 12
+        return [lowest + (ToneHelper.standard_tuning[string] + fret) % 12 + 12 * (fret // 12)
+                for string, fret in enumerate(frets) if fret is not None]
+
+    @staticmethod
+    def fret_notation(frets: [int], custom: {(int,): str}) -> str:
+        """
+        Writes the frets of a column as a command.
+        Fret notation has one character per string, so frets of 12 and up are played an octave down with -8va when
+        every fretted string allows it. Columns that still do not fit are written as a single note ("n:A#2") or, for
+        more than one string, as a custom chord with the same notes.
+        :param frets: the frets, lowest string first
+        :param custom: intervals -> name of the custom chords defined so far, added to if the column needs a new one
+        :return: the command
+        """
+        played = [fret for fret in frets if fret is not None]
+        if all(fret <= 9 for fret in played):
+            return "".join("x" if fret is None else str(fret) for fret in frets)
+        if all(fret >= 12 for fret in played) and all(fret <= 21 for fret in played):
+            return "-8va " + "".join("x" if fret is None else str(fret - 12) for fret in frets)
+
+        notes = TabImport.notes(frets)
+        if len(notes) == 1:
+            return "n:{}{}".format(ToneHelper.name(notes[0]), (notes[0] - MidiWrite.note_map["C"]) // 12 + 2)
+
+        return MidiImport.custom_chord(notes, "Cmaj", custom)
+
+    @staticmethod
+    def commands(lines, columns_per_quarter=4, custom=None):
+        """
+        Turns tab into commands.
+        Columns that do not fit in fret notation are reported once each in MidiWrite.diagnostics; the custom chords
+        they need are added to MidiWrite.custom_index as they are found, so the commands can be rendered while they are
+        read.
+        :param lines: the lines of the tab file (read lazily)
+        :param columns_per_quarter: how many columns of tab make a quarter note
+        :param custom: intervals -> name of the custom chords used, filled in as they are found
+        :return: generator of commands
+        """
+        if custom is None:
+            custom = {}
+        pending = None
+        length = 0
+        flags = {}  # columns -> time flag
+        reported = set()
+
+        for system in TabImport.systems(lines):
+            for frets in TabImport.columns(system):
+                if frets is not None:
+                    count = len(custom)
+                    command = TabImport.fret_notation(frets, custom)
+                    if len(custom) > count:
+                        MidiWrite.custom_index = ChordIndex(ChordIndex.build(
+                            {ChordIndex.chord_key(name): (ChordIndex.kind_intervals, list(intervals))
+                             for intervals, name in custom.items()}))
+
+                    if (command.startswith("n:") or "%" in command) and command not in reported:
+                        reported.add(command)
+                        error = NoteError if command.startswith("n:") else ChordError
+                        MidiWrite.report(error("frets {} do not fit in fret notation, written as {}".format(
+                            "-".join("x" if fret is None else str(fret) for fret in frets), command)), command)
+
+                    if pending is not None:
+                        if length not in flags:
+                            flags[length] = MidiImport.time_flag(length, columns_per_quarter)
+                        yield flags[length] + " " + pending if flags[length] else pending
+                    pending = command
+                    length = 0
+                length += 1
+
+        if pending is not None:
+            flag = MidiImport.time_flag(length, columns_per_quarter)
+            yield flag + " " + pending if flag else pending
+
+    @staticmethod
+    def render(tab_file: str, midi_file: str, columns_per_quarter=4, tempo=120, title=None):
+        """
+        Streams a tab file straight into a midi file.
+        :param tab_file: the tab file
+        :param midi_file: the midi file to write to
+        :param columns_per_quarter: how many columns of tab make a quarter note
+        :param tempo: the bpm
+        :param title: the title of the track
+        :return: the columns that did not fit in fret notation (see TabImport.commands)
+        """
+        if title is None:
+            title = tab_file.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+
+        MidiWrite.write_preqs(midi_file, tempo=tempo)
+        with open(tab_file, "r") as f:
+            return MidiWrite.write_track(midi_file, TabImport.commands(f, columns_per_quarter), title=title)
+
+
+if __name__ == "__main__":
+    source = sys.argv[1]
+    quarter = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    bpm = int(sys.argv[3]) if len(sys.argv) > 3 else 120
+
+    for diagnostic in TabImport.render(source, source.rsplit(".", 1)[0] + ".midi", columns_per_quarter=quarter,
+                                       tempo=bpm):
+        print(diagnostic)
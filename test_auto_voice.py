@@ -0,0 +1,43 @@
+# chords without a root string must be voiced, not read as single notes
+#
+# usage: python -m pytest test_auto_voice.py
+
+from midi_writer import MidiWrite
+
+
+def setup_module():
+    MidiWrite.ppq = MidiWrite.write_var_len(96)
+    MidiWrite.key_signature = "Cmaj"
+
+
+def test_dominant_sixth_and_ninth_chords_are_voiced():
+    chords = ["Cmaj7", "G7", "Am7", "D7", "E6", "C9", "A7"]
+    voiced = MidiWrite.auto_voice(chords)
+
+    for chord, command in zip(chords, voiced):
+        assert command.rstrip("*").endswith(chord)
+        assert command.endswith("*")
+        assert MidiWrite.melody_notes(command) is None
+        assert len(MidiWrite.resolve(command)[0]) > 1
+
+
+def test_unmarked_chords_are_not_notes():
+    for chord in ["G7", "D7", "A7", "C9", "E6", "-q G7"]:
+        assert MidiWrite.melody_notes(chord) is None
+        assert len(MidiWrite.voicings(chord)) > 1
+
+
+def test_marked_notes_and_runs():
+    assert MidiWrite.melody_notes("n:G7") == ('d', [103])
+    assert MidiWrite.melody_notes("-q n:C#4") == ('q', [61])
+    assert MidiWrite.melody_notes("-s n:C4~E4") == ('s', [60, 62, 64])
+    assert MidiWrite.voicings("-e n:C4") == [("-e n:C4", None)]
+
+
+def test_candidates_are_distinct():
+    for chord in ["Cmaj7", "G7", "Am", "Dm9", "E7sus4"]:
+        notes = [tuple(notes) for _, notes in MidiWrite.voicings(chord)]
+        assert len(notes) == len(set(notes))
+
+    # a chord dictionary shape is only moved by octaves: -8vb/''/-8va on three root strings give five octaves
+    assert len(MidiWrite.voicings("Cmaj7")) == 5
@@ -0,0 +1,45 @@
+# chords identified from their notes must play the same pitch classes over the same bass note
+#
+# usage: python -m pytest test_chord_finder.py
+
+import pytest
+from chord_finder import ChordFinder
+from midi_writer import MidiWrite
+from ToneHelper import ToneHelper
+
+types = sorted({shape.rstrip("*") for shape in ToneHelper.chord_dict})
+roots = ["C", "Db", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B"]
+
+
+def setup_module():
+    MidiWrite.set_custom_file(None)
+
+
+def teardown_module():
+    MidiWrite.key_signature = "Cmaj"
+
+
+@pytest.mark.parametrize("key", ["Cmaj", "Ebmaj", "Am"])
+@pytest.mark.parametrize("c_type", types)
+def test_identify(key, c_type):
+    finder = ChordFinder(key)
+    MidiWrite.key_signature = key
+
+    for root in roots:
+        for marker in ["*", "**", "***"]:
+            notes = MidiWrite.resolve(root + c_type + marker)[0]
+            name, numeral = finder.identify(notes)
+
+            found = MidiWrite.resolve(name)[0]
+            assert ChordFinder.mask(found) == ChordFinder.mask(notes)
+            assert min(found) % 12 == min(notes) % 12
+            assert abs(min(found) - min(notes)) < 12
+            if numeral is not None:
+                assert MidiWrite.resolve(numeral, mode="rn_mode")[0] == found
+
+
+def test_unknown_notes():
+    finder = ChordFinder()
+
+    assert finder.identify([48, 49, 50]) is None
+    assert finder.identify([]) is None
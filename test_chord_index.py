@@ -0,0 +1,61 @@
+# a compiled chord index must find the same chords and patterns as the custom file it was compiled from
+#
+# usage: python -m pytest test_chord_index.py
+
+import mmap
+from chord_index import ChordIndex
+from errors import ChordError
+from midi_writer import MidiWrite
+
+custom = """
+7%:x8786x
+7%[2]:0,4,10,16
+m7%:0,7,10,15,19
+sus%[3]:x02230
+"4/4:5";"1-3-2-3"
+"""
+
+
+def setup_module():
+    MidiWrite.ppq = MidiWrite.write_var_len(96)
+
+
+def teardown_module():
+    MidiWrite.set_custom_file(None)
+
+
+def test_lookups(tmp_path):
+    source = tmp_path / "custom.txt"
+    source.write_text(custom)
+    compiled = str(tmp_path / "custom.mwci")
+
+    assert ChordIndex.compile(str(source), compiled) == 5
+    index = ChordIndex.open(compiled)
+    assert isinstance(index.buffer, mmap.mmap)
+
+    assert index.chord("7%") == "x8786x"
+    assert index.chord("7%[2]") == index.chord("7%2") == [0, 4, 10, 16]
+    assert index.chord("m7%") == [0, 7, 10, 15, 19]
+    assert index.chord("sus%[3]") == "x02230"
+    assert index.pattern("4/4:5") == "1-3-2-3"
+    assert index.chord("9%") is None
+    assert index.chord("4/4:5") is None
+    assert index.pattern("7%") is None
+
+
+def test_text_and_compiled_files_play_the_same(tmp_path):
+    source = tmp_path / "custom.txt"
+    source.write_text(custom)
+    compiled = str(tmp_path / "custom.mwci")
+    ChordIndex.compile(str(source), compiled)
+    chords = ["F7%", "Bb7%[2]", "-q Dm7%", "Csus%[3]"]
+
+    MidiWrite.set_custom_file(str(source))
+    text = [MidiWrite.resolve(chord)[0] for chord in chords]
+    assert text[1] == [MidiWrite.note_map["Bb"] + i for i in [0, 4, 10, 16]]
+    assert isinstance(MidiWrite.check_command("E9%"), ChordError)
+
+    MidiWrite.set_custom_file(compiled)
+    assert isinstance(MidiWrite.custom_index.buffer, mmap.mmap)
+    assert [MidiWrite.resolve(chord)[0] for chord in chords] == text
+    assert isinstance(MidiWrite.check_command("E9%"), ChordError)
@@ -0,0 +1,55 @@
+# generated chord types must play their chord tones, from the root on the root string
+#
+# usage: python -m pytest test_chord_vocabulary.py
+
+import pytest
+from chord_vocabulary import ChordVocabulary
+from errors import ChordError
+from midi_writer import MidiWrite
+from ToneHelper import ToneHelper
+
+types = ["m9", "7#9", "maj7#11", "add9", "6/9", "9sus4", "m11", "7b9", "mM9", "5"]
+
+
+def setup_module():
+    MidiWrite.set_custom_file(None)
+
+
+@pytest.mark.parametrize("c_type", types)
+@pytest.mark.parametrize("marker", ["*", "**", "***"])
+def test_voicings_play_the_chord_tones(c_type, marker):
+    tones, _ = ChordVocabulary.formula(c_type)
+    allowed = {semitones % 12 for semitones in tones.values()}
+    # the third, the seventh and altered tones always fit; extensions may be out of reach of the root fret
+    required = {0} | {semitones % 12 for label, semitones in tones.items() if ChordVocabulary.rank(label) <= 2}
+
+    for root in ["C", "F#", "Bb"]:
+        notes = MidiWrite.resolve(root + c_type + marker)[0]
+        intervals = [note - notes[0] for note in notes]
+
+        assert intervals[0] == 0 and notes == sorted(notes)
+        assert {interval % 12 for interval in intervals} <= allowed
+        assert required <= {interval % 12 for interval in intervals}
+
+    assert ChordVocabulary.voicing(c_type, marker) is ChordVocabulary.voicing(c_type, marker)
+
+
+def test_slash_chords_play_the_bass_below():
+    for root in ["C", "E", "A"]:
+        notes = MidiWrite.resolve(root + "m9/G*")[0]
+        above = MidiWrite.resolve(root + "m9*")[0]
+
+        assert notes[0] % 12 == ToneHelper.pitch_class("G") and notes[0] < above[0]
+        assert notes[1:] == above
+
+
+def test_chord_dictionary_comes_first():
+    for c_type in ["maj7", "m7", "7", "dim7", "m7b5"]:
+        for marker in ["*", "**", "***"]:
+            assert MidiWrite.named_intervals("C", c_type, marker) == ToneHelper.chord_dict[c_type + "*"]
+
+
+def test_unknown_types():
+    assert ChordVocabulary.formula("mq") is None
+    assert ChordVocabulary.voicing("mq", "*") is None
+    assert isinstance(MidiWrite.check_command("Cmq*"), ChordError)
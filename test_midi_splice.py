@@ -0,0 +1,69 @@
+# joined files must play the same notes, at the same ticks, as the parts they were joined from
+#
+# usage: python -m pytest test_midi_splice.py
+
+import struct
+from midi_import import MidiImport
+from midi_splice import MidiSplice
+from midi_writer import MidiWrite
+
+
+def render(file, commands):
+    MidiWrite.write_preqs(str(file), time="4/4", tempo=120, ppq=96)
+    MidiWrite.write_track(str(file), commands, title="test")
+    return str(file)
+
+
+def notes(file):
+    return sorted(MidiImport.read_events(file)[2])
+
+
+def length(file):
+    data, _, tracks = MidiSplice.open(file)
+    ticks = max(MidiSplice.track_length(data, track) for track in tracks)
+    data.close()
+    return ticks
+
+
+def test_concatenate(tmp_path):
+    a = render(tmp_path / "a.midi", ["Cmaj7*", "-q Am7**", "-q Dm7*", "G7*"])
+    b = render(tmp_path / "b.midi", ["-w Fmaj7**", "-e E7*"])
+    out = str(tmp_path / "out.midi")
+
+    MidiSplice.concatenate([a, b, a], out)
+
+    shift = length(a)
+    expected = notes(a) + [(tick + shift, on, note) for tick, on, note in notes(b)] + \
+        [(tick + shift + length(b), on, note) for tick, on, note in notes(a)]
+    assert notes(out) == sorted(expected)
+    assert length(out) == 2 * length(a) + length(b)
+
+    with open(out, "rb") as f:
+        data = f.read()
+    assert data.endswith(b'\xff\x2f\x00') and data.count(b'\xff\x2f\x00') == 2  # one per track
+
+
+def test_bar_ranges_join_back_to_the_file(tmp_path):
+    song = render(tmp_path / "song.midi", ["Cmaj7*", "Am7**", "-q Dm7*", "-q G7*", "-h Cmaj7*", "Fmaj7**", "E7*"])
+    out = str(tmp_path / "out.midi")
+
+    split = MidiSplice.bar_range(song, 2, None)[0]
+    MidiSplice.join([(song, 0, split), (song, split, None)], out)
+
+    assert notes(out) == notes(song)
+
+
+def test_meta_data_before_the_end_of_track(tmp_path):
+    # a 100 bpm tempo (09 27 C0) right before an end of track with a two-byte delta time (83 00)
+    track = bytes.fromhex('00ff51030927c0' '00c000' '00903c40' '603c00' '8300ff2f00')
+    file = str(tmp_path / "tempo.midi")
+    with open(file, "wb") as f:
+        f.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, 96) + b'MTrk' + struct.pack('>I', len(track)) + track)
+    out = str(tmp_path / "out.midi")
+
+    MidiSplice.concatenate([file, file], out)
+
+    with open(out, "rb") as f:
+        data = f.read()
+    assert data[22:] == bytes.fromhex('00ff51030927c0' '00c000' '00903c40' '603c00' '8300ff0100'
+                                      '00c000' '00903c40' '603c00' '8300ff2f00')
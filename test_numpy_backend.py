@@ -0,0 +1,48 @@
+# the numpy backend must encode every chord type byte for byte like MidiWrite.encode_commands
+#
+# usage: python -m pytest test_numpy_backend.py
+
+import pytest
+from midi_writer import MidiWrite, MidiWriteError
+from numpy_backend import NumpyBackend
+from ToneHelper import ToneHelper
+
+pytestmark = pytest.mark.skipif(not NumpyBackend.available(), reason="numpy is not installed")
+
+dictionary_types = sorted({shape.rstrip("*") for shape in ToneHelper.chord_dict})
+vocabulary_types = ["7sus4", "maj13", "m9", "add9", "7#9", "maj7#11", "m11", "6/9", "9sus4", "m7/G", "5"]
+
+
+def setup_module():
+    MidiWrite.ppq = MidiWrite.write_var_len(96)
+    MidiWrite.key_signature = "Cmaj"
+
+
+def playable(command: str) -> bool:
+    try:
+        MidiWrite.resolve(command)
+    except MidiWriteError:
+        return False
+    return True
+
+
+@pytest.mark.parametrize("c_type", dictionary_types + vocabulary_types)
+def test_batch_matches_encode_commands(c_type):
+    for marker in MidiWrite.root_markers:
+        progressions = [[flag + root + c_type + marker for flag in ["", "-q ", "-.e "]] for root in ["C", "F#", "Bb"]]
+        progressions = [progression for progression in progressions if all(playable(c) for c in progression)]
+
+        expected = [b''.join(MidiWrite.encode_commands(progression)) for progression in progressions]
+        assert [NumpyBackend.encode_batch([progression])[0] for progression in progressions] == expected
+        if "/" not in c_type:  # the bass of a slash chord moves with the root, so its roots cannot share a batch
+            assert NumpyBackend.encode_batch(progressions) == expected
+
+
+def test_batches_with_different_shapes_are_rejected():
+    with pytest.raises(ValueError):
+        NumpyBackend.encode_batch([["Cm7/G*"], ["Dm7/G*"]])
+
+
+def test_unknown_chord_types_are_rejected():
+    with pytest.raises(ValueError):
+        NumpyBackend.parse("Cxyz*")
@@ -0,0 +1,130 @@
+# every way of rendering a track must write the same bytes as MidiWrite.write_track
+#
+# usage: python -m pytest test_render.py
+
+import pytest
+from midi_writer import MidiWrite
+from pipeline import Pipeline
+from track_index import TrackIndexer
+
+verse = ["Cmaj7*", "-q Am7**", "-e Dm7*", "-e G7*", "n:C4", "-s n:C4~C5"]  # two bars of 4/4
+chorus = ["-w Fmaj7**", "-h G13*", "-h x2222x"]  # two bars
+sections = {"verse": verse, "chorus": chorus}
+commands = ["@verse:3", "-q Bbm7*", "@chorus", "Ebmaj7**", "-e Qq*", "@verse:2", "-ar Ebm7**"]
+expanded = verse * 3 + ["-q Bbm7*"] + chorus + ["Ebmaj7**", "-e Qq*"] + verse * 2 + ["-ar Ebm7**"]
+
+
+def setup_module():
+    MidiWrite.set_custom_file(None)
+
+
+def teardown_module():
+    MidiWrite.set_sections(None)
+
+
+def render(file, commands, pipeline=None, **options) -> bytes:
+    MidiWrite.write_preqs(str(file), time="4/4", tempo=120, ppq=96)
+    if pipeline is not None:
+        pipeline.write_track(str(file), commands, title="test", **options)
+    else:
+        MidiWrite.write_track(str(file), commands, title="test", **options)
+
+    with open(str(file), "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("arpeggiate", [False, True])
+def test_sections_are_the_commands_they_repeat(tmp_path, arpeggiate):
+    assert render(tmp_path / "a.midi", commands, sections=sections, arpeggiate=arpeggiate) == \
+        render(tmp_path / "b.midi", expanded, arpeggiate=arpeggiate)
+
+
+@pytest.mark.parametrize("arpeggiate", [False, True])
+def test_parallel(tmp_path, arpeggiate):
+    expected = render(tmp_path / "a.midi", commands, sections=sections, arpeggiate=arpeggiate)
+    diagnostics = [str(error) for error in MidiWrite.diagnostics]
+    assert len(diagnostics) == 1  # Qq
+
+    assert render(tmp_path / "b.midi", commands, sections=sections, arpeggiate=arpeggiate, workers=2) == expected
+    assert [str(error) for error in MidiWrite.diagnostics] == diagnostics
+
+
+@pytest.mark.parametrize("arpeggiate", [False, True])
+def test_parallel_segments(arpeggiate):
+    # segments of 4 commands, so segments start in both arpeggio directions and in the middle of repeats
+    MidiWrite.ppq = MidiWrite.write_var_len(96)
+    MidiWrite.set_sections(sections)
+    serial = b''.join(MidiWrite.encode_commands(commands * 3, arpeggiate=arpeggiate))
+
+    assert b''.join(MidiWrite.encode_parallel(commands * 3, arpeggiate=arpeggiate, workers=2,
+                                              segment_length=4)) == serial
+
+
+def test_parallel_index(tmp_path):
+    render(tmp_path / "a.midi", commands, sections=sections, index=True)
+    render(tmp_path / "b.midi", commands, sections=sections, index=True, workers=2)
+
+    assert (tmp_path / "a.midi.mwti").read_bytes() == (tmp_path / "b.midi.mwti").read_bytes()
+
+
+@pytest.mark.parametrize("arpeggiate", [False, True])
+def test_pipeline(tmp_path, arpeggiate):
+    expected = render(tmp_path / "a.midi", commands, sections=sections, arpeggiate=arpeggiate)
+    diagnostics = [str(error) for error in MidiWrite.diagnostics]
+
+    # batches of 4, so batches end in the middle of sections
+    assert render(tmp_path / "b.midi", iter(commands), pipeline=Pipeline(batch_size=4, depth=2), sections=sections,
+                  arpeggiate=arpeggiate) == expected
+    assert [str(error) for error in MidiWrite.diagnostics] == diagnostics
+
+
+def test_command_range(tmp_path):
+    assert render(tmp_path / "a.midi", expanded, command_range=(4, 9)) == render(tmp_path / "b.midi", expanded[3:9])
+
+
+@pytest.mark.parametrize("command_range", [(2, 5), (3, 5)])
+def test_command_range_keeps_the_arpeggio_direction(tmp_path, command_range):
+    MidiWrite.ppq = MidiWrite.write_var_len(96)
+    blocks = list(MidiWrite.encode_commands(expanded, arpeggiate=True))
+    first, last = command_range
+
+    preview = render(tmp_path / "a.midi", expanded, arpeggiate=True, command_range=command_range)
+    MidiWrite.write_preqs(str(tmp_path / "b.midi"), time="4/4", tempo=120, ppq=96)
+    MidiWrite.write_encoded_track(str(tmp_path / "b.midi"), blocks[first - 1:last], title="test")
+
+    assert preview == (tmp_path / "b.midi").read_bytes()
+
+
+def test_bars(tmp_path):
+    # bars 4-5 are the second bar of the second verse and the first bar of the third
+    assert render(tmp_path / "a.midi", commands, sections=sections, bars=(4, 5)) == \
+        render(tmp_path / "b.midi", verse[4:] + verse[:4])
+
+
+def test_caches_stay_bounded(tmp_path, monkeypatch):
+    melody = ["-s n:{}{}".format(note, octave) for octave in range(2, 6) for note in "CDEFGAB"]
+    expected = render(tmp_path / "a.midi", melody + commands, sections=sections, index=True)
+    expected_index = (tmp_path / "a.midi.mwti").read_bytes()
+
+    monkeypatch.setattr(MidiWrite, "melody_cache_size", 5)
+    monkeypatch.setattr(TrackIndexer, "layout_cache_size", 3)
+    MidiWrite.melodies.clear()
+    assert render(tmp_path / "b.midi", melody + commands, sections=sections, index=True) == expected
+    assert (tmp_path / "b.midi.mwti").read_bytes() == expected_index
+    assert len(MidiWrite.melodies) <= 5
+
+
+@pytest.mark.parametrize("options", [dict(shift=1), dict(shift=-1), dict(auto_voice=True), dict(bars=(4, 5)),
+                                     dict(command_range=(3, 6), arpeggiate=True), dict(index=True)])
+def test_pipeline_options(tmp_path, options):
+    note_map = dict(MidiWrite.note_map)
+    progression = ["Cmaj7", "Am7", "Dm7", "G7"] if options.get("auto_voice") else commands
+
+    expected = render(tmp_path / "a.midi", progression, sections=sections, **options)
+    MidiWrite.note_map.update(note_map)  # the octave shift stays in place after a render
+    assert render(tmp_path / "b.midi", iter(progression), pipeline=Pipeline(batch_size=4, depth=2), sections=sections,
+                  **options) == expected
+    MidiWrite.note_map.update(note_map)
+
+    if options.get("index"):
+        assert (tmp_path / "a.midi.mwti").read_bytes() == (tmp_path / "b.midi.mwti").read_bytes()
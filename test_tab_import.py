@@ -0,0 +1,57 @@
+# every note of a tab must be played, also for frets that do not fit in fret notation
+#
+# usage: python -m pytest test_tab_import.py
+
+from errors import ChordError, NoteError
+from midi_import import MidiImport
+from midi_writer import MidiWrite
+from tab_import import TabImport
+
+tab = """
+e|-------0-----10-------|-----|
+B|-----1----------------|-11--|
+G|---2-----11--------14-|-----|
+D|-2-------------12--12-|-----|
+A|---------10-----------|-----|
+E|-------------0--------|-----|
+"""
+
+
+def setup_module():
+    MidiWrite.ppq = MidiWrite.write_var_len(96)
+    MidiWrite.key_signature = "Cmaj"
+
+
+def played(command: str) -> [int]:
+    melody = MidiWrite.melody_notes(command.split(" ")[-1])
+    return sorted(melody[1] if melody is not None else MidiWrite.resolve(command)[0])
+
+
+def test_every_column_keeps_its_notes():
+    columns = [frets for system in TabImport.systems(tab.splitlines()) for frets in TabImport.columns(system)
+               if frets is not None]
+    MidiWrite.diagnostics = []
+    commands = list(TabImport.commands(tab.splitlines()))
+
+    assert len(commands) == len(columns)
+    for frets, command in zip(columns, commands):
+        assert played(command) == sorted(TabImport.notes(frets))
+
+    assert commands[-3:-1] == ["-q -8va xx0xxx", "-q -8va xx02xx"]
+    assert commands[-1] == "-q n:A#3"
+    assert sum("%" in command for command in commands) == 2
+    assert any("n:" in command for command in commands)
+    assert [type(error) for error in MidiWrite.diagnostics].count(ChordError) == 2
+    assert [type(error) for error in MidiWrite.diagnostics].count(NoteError) == 1
+
+
+def test_render(tmp_path):
+    source = tmp_path / "song.tab"
+    source.write_text(tab)
+    out = str(tmp_path / "song.midi")
+
+    diagnostics = TabImport.render(str(source), out)
+
+    events = MidiImport.read_events(out)[2]
+    assert sum(on for _, on, _ in events) == 12
+    assert len(diagnostics) == 3
@@ -0,0 +1,109 @@
+# the sidecar index must point at the events that start each bar and each command
+#
+# usage: python -m pytest test_track_index.py
+
+import pytest
+from midi_events import MidiEvents
+from midi_writer import MidiWrite
+from track_index import TrackIndex, TrackIndexer
+
+# just over four bars of 3/4: quarter notes, eighth notes, a chord over the bar line and a scale run
+commands = ["-q Cmaj7*", "-q Am7**", "-q Dm7*", "-e G7*", "-e G7*", "-.h Cmaj*", "-h Fmaj7**", "-q n:C4~E4",
+            "-q Bbm7*"]
+
+
+def setup_module():
+    MidiWrite.set_custom_file(None)
+
+
+@pytest.fixture
+def song(tmp_path):
+    file = str(tmp_path / "song.midi")
+    MidiWrite.write_preqs(file, time="3/4", tempo=120, ppq=96)
+    MidiWrite.write_track(file, commands, title="test", index=True)
+    return file
+
+
+def events(file, data_offset):
+    """
+    Reads the track from its data: (tick of the event before, tick, offset) of each event with a status byte.
+    """
+    with open(file, "rb") as f:
+        data = f.read()
+
+    found = []
+    pos, tick, status = data_offset, 0, 0
+    while pos < len(data):
+        start = pos
+        delta, pos = MidiEvents.read_var_len(data, pos)
+        base, tick = tick, tick + delta
+
+        kind = data[pos]
+        if kind < 0x80:
+            kind = status  # running status
+        else:
+            found.append((base, tick, start - data_offset))
+            pos += 1
+            if kind < 0xf0:
+                status = kind
+        pos = MidiEvents.event_end(data, pos, kind)[1]
+
+    return found
+
+
+def test_header(song):
+    index = TrackIndex.open(song)
+
+    assert (index.ppq, index.time_signature) == (96, "3/4")
+    assert index.command_count == len(commands)
+    assert index.bar_count == 5
+
+
+def test_bars(song):
+    index = TrackIndex.open(song)
+    found = events(song, index.data_offset)
+
+    for n in range(1, index.bar_count + 1):
+        line = (n - 1) * 3 * 96
+        # the first event at or after the bar line
+        base, tick, offset = next(event for event in found if event[1] >= line)
+        assert index.bar(n) == (base, offset)
+
+
+def test_commands(song):
+    index = TrackIndex.open(song)
+    found = events(song, index.data_offset)
+    starts = {offset: base for base, _, offset in found}
+
+    MidiWrite.ppq = MidiWrite.write_var_len(96)
+    blocks = list(MidiWrite.encode_commands(commands))
+    with open(song, "rb") as f:
+        data = f.read()
+
+    tick = 0
+    for n, block in enumerate(blocks, 1):
+        base, offset = index.command(n)
+        assert data[index.data_offset + offset:].startswith(block)
+        assert starts[offset] == base == tick
+        tick += MidiWrite.command_ticks(commands[n - 1])
+
+
+def test_out_of_range(song):
+    index = TrackIndex.open(song)
+
+    with pytest.raises(IndexError):
+        index.bar(index.bar_count + 1)
+    with pytest.raises(IndexError):
+        index.command(0)
+
+
+def test_layouts_stay_bounded(monkeypatch):
+    monkeypatch.setattr(TrackIndexer, "layout_cache_size", 3)
+    MidiWrite.ppq = MidiWrite.write_var_len(96)
+    indexer = TrackIndexer(96, "4/4")
+    indexer.start(0, 0)
+
+    for block in MidiWrite.encode_commands(commands * 2):
+        indexer.add(block)
+        assert len(indexer.layouts) <= 3
+    assert indexer.tick == 2 * sum(MidiWrite.command_ticks(command) for command in commands)
@@ -0,0 +1,45 @@
+# outcomes remembered by MidiWrite.validate must not carry over to files with other sections or custom files
+#
+# usage: python -m pytest test_validate.py
+
+import os
+import pytest
+from errors import ChordError, SectionError
+from midi_writer import MidiWrite
+
+extras = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extras.txt")
+
+
+def setup_module():
+    MidiWrite.ppq = MidiWrite.write_var_len(96)
+
+
+def teardown_module():
+    MidiWrite.set_custom_file(None)
+    MidiWrite.set_sections(None)
+
+
+def test_section_references_are_checked_against_each_file():
+    assert MidiWrite.validate(["@verse:2"], sections={"verse": ["Cmaj7*", "Am7**"]}) == []
+
+    errors = MidiWrite.validate(["@verse:2"])
+    assert len(errors) == 1 and isinstance(errors[0], SectionError)
+
+
+def test_custom_file_is_cleared():
+    MidiWrite.set_custom_file(extras)
+    assert MidiWrite.validate(["F7%"]) == []
+
+    MidiWrite.set_custom_file(None)
+    assert MidiWrite.custom_index is None
+    errors = MidiWrite.validate(["F7%"])
+    assert len(errors) == 1 and isinstance(errors[0], ChordError)
+
+
+def test_unknown_key_is_a_chord_error():
+    errors = MidiWrite.validate(["I*", "V7*"], mode="rn_mode", key="Hmaj")
+    assert [type(error) for error in errors] == [ChordError, ChordError]
+    assert [error.command for error in errors] == ["I*", "V7*"]
+
+    with pytest.raises(ChordError):
+        MidiWrite.write_track(os.devnull, ["Cmaj7*"], key="Hmaj")
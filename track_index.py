@@ -0,0 +1,208 @@
+# sidecar index of the bars and commands of a rendered track
+#
+# usage: python track_index.py [midi file] [bar]
+#
+# Written next to a midi file as [midi file].mwti when it is rendered with --index (write_track(..., index=True)):
+#
+#   header    magic 'MWTI', version, ppq, time signature, file offset of the track data, number of bars and commands
+#   bars      (tick, offset) of every bar
+#   commands  (tick, offset) of every command
+#
+# An offset points into the data of the track chunk holding the chords, at an event that has its own status byte, so
+# decoding can start there without knowing anything that came before. The tick is the time of the event before it:
+# adding up delta times from there gives the absolute time of every event that follows. A command's entry is its first
+# event, a bar's entry is the first event at or after the bar line. Seeking to bar n or command n is one record lookup
+# instead of reading every delta time from the start of the track.
+
+import bisect
+import mmap
+import struct
+import sys
+from midi_events import MidiEvents
+
+
+class TrackIndex:
+    magic = b'MWTI'
+    version = 1
+    extension = ".mwti"
+
+    header = struct.Struct(">4sHHBBQII")  # magic, version, ppq, numerator, denominator, data offset, bars, commands
+    entry = struct.Struct(">QI")          # tick, offset
+
+    def __init__(self, buffer, source=None):
+        """
+        Wraps an index.
+        :param buffer: the index (bytes or a memory map)
+        :param source: the file the index was loaded from
+        """
+        magic, version, ppq, numerator, denominator, data_offset, bars, commands = \
+            TrackIndex.header.unpack_from(buffer, 0)
+        if magic != TrackIndex.magic or version != TrackIndex.version:
+            raise ValueError("{} is not a track index".format(source))
+
+        self.buffer = buffer
+        self.source = source
+        self.ppq = ppq
+        self.time_signature = "{}/{}".format(numerator, denominator)
+        self.data_offset = data_offset
+        self.bar_count = bars
+        self.command_count = commands
+
+    @staticmethod
+    def open(file: str):
+        """
+        Opens the index of a midi file.
+        :param file: the midi file
+        :return: the index
+        """
+        with open(file + TrackIndex.extension, "rb") as f:
+            return TrackIndex(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), file + TrackIndex.extension)
+
+    def lookup(self, n: int, first: int) -> (int, int):
+        """
+        Reads an entry.
+        :param n: the entry, counting from 0
+        :param first: the number of entries before the table holding it
+        :return: (tick, offset in the track data)
+        """
+        return TrackIndex.entry.unpack_from(self.buffer, TrackIndex.header.size + (first + n) * TrackIndex.entry.size)
+
+    def bar(self, n: int) -> (int, int):
+        """
+        Finds where a bar starts.
+        :param n: the bar, counting from 1
+        :return: (tick, offset in the track data)
+        """
+        if not 1 <= n <= self.bar_count:
+            raise IndexError("bar {} is not in {} ({} bars)".format(n, self.source, self.bar_count))
+
+        return self.lookup(n - 1, 0)
+
+    def command(self, n: int) -> (int, int):
+        """
+        Finds where a command starts.
+        :param n: the command, counting from 1 (a section repeat counts as one command)
+        :return: (tick, offset in the track data)
+        """
+        if not 1 <= n <= self.command_count:
+            raise IndexError("command {} is not in {} ({} commands)".format(n, self.source, self.command_count))
+
+        return self.lookup(n - 1, self.bar_count)
+
+
+class TrackIndexer:
+    layout_cache_size = 1024  # blocks kept in layouts; it starts over when full
+
+    def __init__(self, ppq: int, time_signature: str):
+        """
+        Collects the positions of bars and commands while a track is written.
+        :param ppq: the parts per quarter
+        :param time_signature: the time signature, e.g. '3/4'
+        """
+        self.ppq = ppq
+        self.numerator, self.denominator = [int(n) for n in time_signature.split("/")]
+        self.bar_ticks = ppq * 4 * self.numerator // self.denominator
+        self.data_offset = 0
+        self.tick = 0
+        self.offset = 0
+        self.bars = []
+        self.commands = []
+        self.layouts = {}  # encoded events -> layout, repeated chords are only read once
+
+    @staticmethod
+    def layout(events: bytes) -> ([int], [int], [int], int):
+        """
+        Finds the events of a block that decoding can start at (the ones with a status byte).
+        :param events: the encoded events
+        :return: the tick of each such event, the tick of the event before it and its offset (all relative to the start
+                 of the block), and the length of the block in ticks
+        """
+        ticks, bases, offsets = [], [], []
+        pos, tick, status = 0, 0, 0
+
+        while pos < len(events):
+            start = pos
+            delta, pos = MidiEvents.read_var_len(events, pos)
+            base, tick = tick, tick + delta
+
+            kind = events[pos]
+            if kind < 0x80:
+                kind = status
+            else:
+                ticks.append(tick)
+                bases.append(base)
+                offsets.append(start)
+                pos += 1
+                if kind < 0xf0:
+                    status = kind
+
+            pos = MidiEvents.event_end(events, pos, kind)[1]
+
+        return ticks, bases, offsets, tick
+
+    def start(self, data_offset: int, prefix: int):
+        """
+        Starts the track. Bar 1 starts at the beginning of the track data.
+        :param data_offset: the file offset of the track data
+        :param prefix: the length of the events written before the first command (all at tick 0)
+        :return: none
+        """
+        self.data_offset = data_offset
+        self.offset = prefix
+        self.bars.append((0, 0))
+
+    def command(self):
+        """
+        Marks the start of the next command.
+        :return: none
+        """
+        self.commands.append((self.tick, self.offset))
+
+    def add(self, events: bytes):
+        """
+        Follows a block of encoded events as it is written, noting the bar lines it crosses.
+        :param events: the encoded events
+        :return: none
+        """
+        layout = self.layouts.get(events)
+        if layout is None:
+            if len(self.layouts) >= TrackIndexer.layout_cache_size:
+                self.layouts.clear()
+            layout = self.layouts[events] = TrackIndexer.layout(events)
+        ticks, bases, offsets, length = layout
+
+        i = 0
+        while True:
+            i = bisect.bisect_left(ticks, len(self.bars) * self.bar_ticks - self.tick, i)
+            if i == len(ticks):
+                break
+            self.bars.append((self.tick + bases[i], self.offset + offsets[i]))
+
+        self.tick += length
+        self.offset += len(events)
+
+    def write(self, file: str):
+        """
+        Writes the index next to the midi file. Bar lines after the last event point at the end of the track.
+        :param file: the midi file
+        :return: none
+        """
+        while len(self.bars) * self.bar_ticks < self.tick:
+            self.bars.append((self.tick, self.offset))
+
+        with open(file + TrackIndex.extension, "wb") as f:
+            f.write(TrackIndex.header.pack(TrackIndex.magic, TrackIndex.version, self.ppq, self.numerator,
+                                           self.denominator, self.data_offset, len(self.bars), len(self.commands)))
+            for tick, offset in self.bars + self.commands:
+                f.write(TrackIndex.entry.pack(tick, offset))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: python track_index.py [midi file] [bar]")
+        exit(1)
+
+    index = TrackIndex.open(sys.argv[1])
+    tick, offset = index.bar(int(sys.argv[2]))
+    print("bar {} of {}: tick {}, byte {} of the track data (byte {} of the file)".format(
+        sys.argv[2], sys.argv[1], tick, offset, index.data_offset + offset))